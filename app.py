@@ -2,18 +2,24 @@ from __future__ import annotations
 
 import os
 import time
+from dataclasses import replace
 import pandas as pd
 import streamlit as st
 
 from src.config import load_config
 from src.data_loader import load_examples
 from src.llm import LLMClient
+from src.llm_cache import build_llm_cache
 from src.memory import MemoryTurn, trim_memory
 from src.preprocess import normalize_question
-from src.prompt import build_prompt, rewrite_question
+from src.pipeline import generate_for_question
 from src.retrieval import HybridRetriever
-from src.schema import get_schema
+from src.review_gate import RiskGate
+from src.schema import load_catalog
+from src.schema_linking import SchemaLinker
 from src.sql_executor import execute_sql
+from src.sql_validator import SQLValidationError, SQLValidator, format_issues, is_query, parse_select
+from src.value_index import ValueIndex
 
 st.set_page_config(page_title="Text2SQL 智能问数系统", layout="wide")
 
@@ -57,12 +63,42 @@ with st.sidebar:
 
 @st.cache_resource(show_spinner=False)
 def _load_resources(train_path: str, db_path_val: str):
-    schema = get_schema(db_path_val)
+    catalog = load_catalog(db_path_val, config.schema_cache_dir, config.schema_sample_rows)
     examples = load_examples(train_path, "college_2")
-    retriever = HybridRetriever(examples)
-    return schema, retriever
+    retriever = HybridRetriever(
+        examples,
+        model_name=config.encoder_model,
+        encoder_backend=config.encoder_backend,
+        onnx_file=config.encoder_onnx_file,
+        tfidf_max_df=config.tfidf_max_df,
+        cache_dir=config.index_cache_dir,
+        index_spec=config.vector_index,
+        fusion=config.fusion,
+    )
+    value_index = None
+    if config.value_index:
+        value_index = ValueIndex.load(db_path_val, config.value_index_dir, config.value_index_top)
+    linker = None
+    if config.schema_linking:
+        linker = SchemaLinker(
+            catalog,
+            encode=retriever.encode,
+            token_budget=config.schema_token_budget or config.prompt_budget.schema_tokens,
+            with_samples=value_index is None,
+        )
+    validator = SQLValidator(catalog) if config.sql_validation else None
+    schema = catalog.to_text(with_samples=value_index is None)
+    return schema, retriever, linker, value_index, validator
 
-schema_text, retriever = _load_resources(os.path.join(config.data_root, "train.json"), db_path)
+@st.cache_resource(show_spinner=False)
+def _load_llm_cache():
+    # 跨会话共享的 LLM 响应缓存（未设置 LLM_CACHE_PATH 时为 None）
+    return build_llm_cache(config)
+
+llm_cache = _load_llm_cache()
+if llm_cache is not None:
+    st.sidebar.caption(f"LLM 缓存命中: {llm_cache.stats()}")
+schema_text, retriever, linker, value_index, validator = _load_resources(os.path.join(config.data_root, "train.json"), db_path)
 
 col_left, col_right = st.columns([2, 1])
 
@@ -74,41 +110,77 @@ with col_left:
         normalized = normalize_question(prompt_input)
         st.session_state["chat"].append({"role": "user", "content": normalized})
         
-        llm = LLMClient(model_name=model_name, api_key=api_key or None, base_url=base_url or None, temperature=temperature)
+        llm = LLMClient(model_name=model_name, api_key=api_key or None, base_url=base_url or None, temperature=temperature, cache=llm_cache, max_concurrency=config.llm_max_concurrency)
         history = trim_memory(st.session_state["memory"], memory_turns)
 
         with st.status("🚀 智能体正在思考...", expanded=True) as status:
-            # 1. 重写
-            target_q = normalized
-            if history:
-                st.write("🔄 正在分析上下文...")
-                rewritten = rewrite_question(llm, normalized, history)
-                if rewritten != normalized:
-                    st.write(f"📝 重写问题: **{rewritten}**")
-                    target_q = rewritten
-            
-            # 2. 检索
-            st.write("🔍 正在检索混合示例...")
-            few_shot = retriever.search(target_q, k=top_k)
-            
-            # 3. 生成
+            # 重写、检索与 SQL 生成并发执行（重写在途时即开始检索并起草）
+            st.write("🔄 正在分析上下文并检索混合示例..." if history else "🔍 正在检索混合示例...")
             st.write("🤖 正在生成 SQL...")
-            full_prompt = build_prompt(schema_text, few_shot, target_q, history)
-            st.session_state["last_prompt"] = full_prompt
-            st.session_state["last_example_count"] = len(few_shot)
-            
             start_time = time.time()
-            sql = llm.generate_sql(full_prompt)
+            # 流式模式下流水线只组装 Prompt，SQL 草稿边生成边显示（自洽投票需要完整候选，不流式）
+            streaming = config.stream_sql and not config.self_consistency.enabled
+            review_gate = RiskGate(db_path, validator) if config.review_mode == "gated" else None
+            generated = generate_for_question(
+                llm, retriever, schema_text, normalized, history, top_k,
+                linker=linker, value_index=value_index,
+                self_consistency=config.self_consistency, db_path=db_path, validator=validator,
+                generate=not streaming, budget=config.prompt_budget,
+                review_gate=review_gate,
+            )
+            if streaming:
+                sql_stream = llm.stream_sql(generated.prompt)
+                st.write_stream(sql_stream)
+                sql = sql_stream.sql.strip()
+                try:
+                    parse_select(sql)
+                except SQLValidationError:
+                    # 草稿不是单条可解析的查询（SELECT / WITH ...）时退回完整的两阶段生成
+                    sql = llm.generate_sql(generated.prompt, review_gate)
+                else:
+                    # 草稿同样按 REVIEW_MODE 复查（gated 时只在本地检查发现风险时调用）
+                    reviewed = llm.review_sql(generated.prompt, sql, review_gate)
+                    if reviewed != sql:
+                        st.write("🔎 复查后修正了草稿 SQL")
+                    sql = reviewed
+                generated = replace(generated, sql=sql)
             latency = time.time() - start_time
+            if llm.usage.calls:
+                prompt_tokens, cached_tokens = llm.usage.last
+                st.caption(
+                    f"最近一次调用输入 {prompt_tokens} tokens（前缀缓存命中 {cached_tokens}，"
+                    f"未命中 {prompt_tokens - cached_tokens}）；本题 {llm.usage.stats()}"
+                )
+
+            target_q, few_shot, full_prompt, sql = (
+                generated.question, generated.few_shot, generated.prompt, generated.sql
+            )
+            if target_q != normalized:
+                st.write(f"📝 重写问题: **{target_q}**")
+            if generated.votes:
+                st.write(f"🗳️ 候选投票: {generated.votes[0]}/{generated.votes[1]} 条候选结果一致")
+            st.session_state["last_prompt"] = full_prompt
+            st.session_state["last_example_count"] = len(few_shot)
             
-            if not sql.strip().lower().startswith("select"):
+            if not is_query(sql):
                 status.update(label="⚠️ 未能生成有效查询", state="error")
                 st.session_state["chat"].append({"role": "assistant", "content": f"未能生成有效 SQL。LLM 输出：\n\n```\n{sql}\n```"})
             else:
                 st.write("⚡ 正在执行查询...")
                 try:
+                    # 静态检查不通过时跳过执行，直接带着结构化错误修复
+                    # 自洽投票时候选已校验并执行过，直接使用胜出结果
+                    issues = validator.validate(sql) if validator is not None and generated.votes is None else []
                     try:
-                        result = execute_sql(db_path, sql)
+                        if generated.error:
+                            raise ValueError(generated.error)
+                        if issues:
+                            raise ValueError(format_issues(issues))
+                        if generated.result is not None:
+                            result = generated.result
+                        else:
+                            # 执行器先 EXPLAIN 估计代价，超限时不执行，直接带着原因修复
+                            result = execute_sql(db_path, sql)
                     except Exception as e:
                         # Execution-guided self-correction (retry once)
                         fixed_sql = llm.repair_sql(full_prompt, sql, str(e))
@@ -117,7 +189,8 @@ with col_left:
                     status.update(label=f"✅ 完成 (耗时 {latency:.2f}s)", state="complete")
                     st.session_state["chat"].append({
                         "role": "assistant",
-                        "content": f"已生成 SQL：\n```sql\n{sql}\n```\n查询到 {result.row_count} 条结果。",
+                        "content": f"已生成 SQL：\n```sql\n{sql}\n```\n查询到 {result.row_count} 条结果"
+                        + ("（超出返回上限，已截断）。" if result.truncated else "。"),
                         "result": result
                     })
                     st.session_state["memory"].append(MemoryTurn(question=target_q, sql=sql))
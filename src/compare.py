@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import itertools
+import math
+import pickle
+from dataclasses import dataclass
+
+# 存在取值完全相同的列时，最多尝试的列排列数
+_MAX_TIE_PERMUTATIONS = 5040
+
+
+def normalize_val(v):
+    if v is None: return None
+    if isinstance(v, (int, float)): return float(v)
+    return str(v).strip().lower()
+
+
+def normalize_rows(rows: list[tuple]) -> list[tuple]:
+    return [tuple(normalize_val(x) for x in row) for row in rows]
+
+
+def _value_key(v) -> tuple:
+    # None / 数值 / 字符串混排时仍可排序
+    if v is None: return (0, 0.0, "")
+    if isinstance(v, float): return (1, v, "")
+    return (2, 0.0, v)
+
+
+def _row_key(row: tuple) -> tuple:
+    return tuple(_value_key(v) for v in row)
+
+
+def _sort(values: list, key) -> list:
+    # 同类型值直接按 C 层比较排序；混入 None 或数值/字符串混排时退回到带 key 的排序
+    try:
+        values.sort()
+    except TypeError:
+        values.sort(key=key)
+    return values
+
+
+def _digest(values: list) -> str:
+    # 归一化后只含 None/float/str，pickle 序列化远快于 repr；
+    # 关闭 memo（fast 模式），否则同一字符串对象被引用两次与两个相等的字符串序列化结果不同
+    buf = io.BytesIO()
+    pickler = pickle.Pickler(buf, protocol=4)
+    pickler.fast = True
+    pickler.dump(values)
+    return hashlib.sha1(buf.getvalue()).hexdigest()
+
+
+def is_ordered(sql: str) -> bool:
+    """最外层查询是否带 ORDER BY（子查询中的 ORDER BY 不影响结果顺序的比对）。"""
+    depth = 0
+    quote = None
+    lowered = sql.lower()
+    for i, ch in enumerate(lowered):
+        if quote:
+            if ch == quote: quote = None
+            continue
+        if ch in ("'", '"', "`"):
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0 and lowered.startswith("order", i) and (i == 0 or not lowered[i - 1].isalnum()):
+            rest = lowered[i + 5:].lstrip()
+            if rest.startswith("by"): return True
+    return False
+
+
+@dataclass(frozen=True)
+class CanonicalResult:
+    """
+    结果集的规范形式：列按各自取值多重集的签名排序，
+    无序结果的行再按值排序，因此列顺序、行顺序不同但内容相同的结果规范形式一致。
+    """
+
+    # 按签名重排列后的行；ordered=False 时行已排序
+    rows: tuple[tuple, ...]
+    # 与 rows 的列一一对应的列签名（已排序）
+    column_signatures: tuple[str, ...]
+    ordered: bool
+    digest: str
+
+
+def canonicalize(rows: list[tuple], ordered: bool = False) -> CanonicalResult:
+    norm_rows = normalize_rows(rows)
+    num_cols = len(norm_rows[0]) if norm_rows else 0
+    signatures = [
+        _digest(_sort([row[j] for row in norm_rows], _value_key)) for j in range(num_cols)
+    ]
+    order = sorted(range(num_cols), key=lambda j: signatures[j])
+    canonical_rows = [tuple(row[j] for j in order) for row in norm_rows]
+    if not ordered:
+        _sort(canonical_rows, _row_key)
+    return CanonicalResult(
+        rows=tuple(canonical_rows),
+        column_signatures=tuple(signatures[j] for j in order),
+        ordered=ordered,
+        digest=_digest(canonical_rows),
+    )
+
+
+def _tie_groups(signatures: tuple[str, ...]) -> list[list[int]]:
+    groups: list[list[int]] = []
+    for j, sig in enumerate(signatures):
+        if groups and signatures[groups[-1][0]] == sig:
+            groups[-1].append(j)
+        else:
+            groups.append([j])
+    return [g for g in groups if len(g) > 1]
+
+
+def compare_canonical(pred: CanonicalResult, gold: CanonicalResult) -> bool:
+    """
+    按多重集语义比较（重复行计数），列顺序无关；gold 为有序结果时同时要求行顺序一致。
+    pred 需按 gold.ordered 规范化。
+    """
+    if not pred.rows and not gold.rows: return True
+    if len(pred.rows) != len(gold.rows): return False
+    if pred.column_signatures != gold.column_signatures: return False
+    if pred.digest == gold.digest: return True
+
+    # 取值多重集完全相同的列无法靠签名区分，只在这些列组内部尝试排列
+    groups = _tie_groups(gold.column_signatures)
+    if not groups: return False
+    if math.prod(math.factorial(len(g)) for g in groups) > _MAX_TIE_PERMUTATIONS: return False
+
+    num_cols = len(gold.column_signatures)
+    gold_rows = list(gold.rows)
+    for perms in itertools.product(*(itertools.permutations(g) for g in groups)):
+        mapping = list(range(num_cols))
+        for group, perm in zip(groups, perms):
+            for src, dst in zip(group, perm):
+                mapping[src] = dst
+        candidate = [tuple(row[j] for j in mapping) for row in pred.rows]
+        if not pred.ordered:
+            _sort(candidate, _row_key)
+        if candidate == gold_rows: return True
+    return False
+
+
+def compare_results(pred: list[tuple], gold: list[tuple], ordered: bool = False) -> bool:
+    return compare_canonical(canonicalize(pred, ordered), canonicalize(gold, ordered))
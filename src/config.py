@@ -7,6 +7,124 @@ from dotenv import load_dotenv
 # 加载 .env 文件
 load_dotenv()
 
+@dataclass(frozen=True)
+class VectorIndexSpec:
+    """
+    向量索引类型与参数：
+    flat（精确）/ ivf（IVF-Flat）/ hnsw / ivfpq（IVF + 乘积量化）。
+    nlist / hnsw_m / ef_construction / pq_m / pq_nbits 为训练参数，nprobe / ef_search 为检索参数。
+    """
+    kind: str = "flat"
+    nlist: int = 256
+    nprobe: int = 16
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    pq_m: int = 16
+    pq_nbits: int = 8
+
+    @property
+    def cache_name(self) -> str:
+        # 只包含影响索引结构的训练参数，检索参数加载后再设置
+        if self.kind == "ivf":
+            return f"ivf-nlist{self.nlist}"
+        if self.kind == "hnsw":
+            return f"hnsw-m{self.hnsw_m}-efc{self.ef_construction}"
+        if self.kind == "ivfpq":
+            return f"ivfpq-nlist{self.nlist}-pq{self.pq_m}x{self.pq_nbits}"
+        return "flat"
+
+
+@dataclass(frozen=True)
+class FusionSpec:
+    """
+    混合检索的融合方式：
+    rrf（倒数排名融合）/ weighted（各路得分 min-max 归一化后加权求和）。
+    semantic_weight 为向量检索一路的权重，TF-IDF 一路为 1 - semantic_weight。
+    """
+    method: str = "rrf"
+    semantic_weight: float = 0.5
+    rrf_k: int = 60
+
+    @property
+    def label(self) -> str:
+        if self.method == "rrf":
+            return f"rrf(k={self.rrf_k}, w_sem={self.semantic_weight:g})"
+        return f"{self.method}(w_sem={self.semantic_weight:g})"
+
+
+@dataclass(frozen=True)
+class ExecutorSpec:
+    """
+    SQL 执行器参数：连接池（仅 DB_URL）、分块取数与结果字节上限、墙钟超时、SQLite VM 步数上限、
+    EXPLAIN 代价上限（SQLite 为估计的行访问次数，PostgreSQL 为规划器代价单位）及结果缓存。
+    None 表示不限制；cache_entries 为 0 时关闭结果缓存。
+    """
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_pre_ping: bool = True
+    chunk_size: int = 500
+    max_bytes: int | None = 16 * 1024 * 1024
+    timeout: float | None = 10.0
+    max_vm_steps: int | None = None
+    max_cost: float | None = 1e8
+    cache_entries: int = 256
+    cache_bytes: int = 64 * 1024 * 1024
+    cache_path: str | None = None
+
+
+@dataclass(frozen=True)
+class SelfConsistencySpec:
+    """
+    自洽投票：并发生成 candidates 条候选 SQL（第一条沿用模型默认温度，其余按 temperature 采样），
+    全部执行后按结果集多数投票。candidates <= 1 时关闭；timeout 为等待候选的最长秒数，超时未返回的候选不参与投票。
+    """
+    candidates: int = 1
+    temperature: float = 0.7
+    timeout: float | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.candidates > 1
+
+    @property
+    def label(self) -> str:
+        if not self.enabled:
+            return "关"
+        timeout = f", timeout={self.timeout:g}s" if self.timeout else ""
+        return f"{self.candidates} 候选(T={self.temperature:g}{timeout})"
+
+
+@dataclass(frozen=True)
+class PromptBudgetSpec:
+    """
+    Prompt 的 token 预算：total 为整条 Prompt 的上限（0 不限制），按比例分给 Schema、Few-shot 与记忆。
+    Schema 份额作为 Schema 裁剪的预算（未单独设置 SCHEMA_TOKEN_BUDGET 时）；
+    指令、Schema、取值与问题计入后剩余的 token 按 few_shot : memory 分配，示例未用完的部分留给记忆。
+    """
+    total: int = 0
+    schema_share: float = 0.5
+    few_shot_share: float = 0.35
+    memory_share: float = 0.15
+
+    @property
+    def enabled(self) -> bool:
+        return self.total > 0
+
+    @property
+    def schema_tokens(self) -> int | None:
+        return int(self.total * self.schema_share) or None if self.enabled else None
+
+    @property
+    def label(self) -> str:
+        if not self.enabled:
+            return "不限"
+        return (
+            f"{self.total} (Schema {self.schema_share:g} / 示例 {self.few_shot_share:g}"
+            f" / 记忆 {self.memory_share:g})"
+        )
+
+
 @dataclass(frozen=True)
 class AppConfig:
     data_root: str
@@ -19,7 +137,33 @@ class AppConfig:
     api_key: str | None
     base_url: str | None
     temperature: float
+    llm_max_concurrency: int
     top_k_examples: int
+    tfidf_max_df: float
+    index_cache_dir: str | None
+    gold_store_dir: str | None
+    schema_cache_dir: str | None
+    schema_sample_rows: int
+    schema_linking: bool
+    schema_token_budget: int | None
+    value_index: bool
+    value_index_dir: str | None
+    value_index_top: int
+    sql_validation: bool
+    executor: ExecutorSpec
+    stream_sql: bool
+    review_mode: str
+    vector_index: VectorIndexSpec
+    fusion: FusionSpec
+    self_consistency: SelfConsistencySpec
+    prompt_budget: PromptBudgetSpec
+    encoder_model: str
+    encoder_backend: str
+    encoder_onnx_file: str | None
+    llm_cache_path: str | None
+    llm_cache_semantic_threshold: float
+    llm_cache_ttl: float
+    llm_cache_max_entries: int
 
 
 def load_config() -> AppConfig:
@@ -41,5 +185,85 @@ def load_config() -> AppConfig:
         api_key=os.getenv("LLM_API_KEY"),
         base_url=os.getenv("LLM_BASE_URL"),
         temperature=float(os.getenv("TEMPERATURE", "0")),
+        llm_max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
         top_k_examples=int(os.getenv("TOP_K", "5")),
+        tfidf_max_df=float(os.getenv("TFIDF_MAX_DF", "1.0")),
+        # 设为空字符串可关闭检索索引的磁盘缓存
+        index_cache_dir=os.getenv(
+            "INDEX_CACHE_DIR", os.path.join(data_root, "cache", "index")
+        ) or None,
+        # 评测用标准 SQL 结果的预计算存储，设为空字符串则每次重新执行
+        gold_store_dir=os.getenv(
+            "GOLD_STORE_DIR", os.path.join(data_root, "cache", "gold")
+        ) or None,
+        # 数据库结构目录（表、外键、示例值）的磁盘缓存，只对定义变化的表重新采集
+        schema_cache_dir=os.getenv(
+            "SCHEMA_CACHE_DIR", os.path.join(data_root, "cache", "schema")
+        ) or None,
+        # 每张表采样的行数，从中取各列的示例值
+        schema_sample_rows=int(os.getenv("SCHEMA_SAMPLE_ROWS", "1000")),
+        # 按问题裁剪 Schema（只保留相关表），token 预算设为 0 表示不限
+        schema_linking=os.getenv("SCHEMA_LINKING", "0").lower() in ("1", "true", "yes"),
+        schema_token_budget=int(os.getenv("SCHEMA_TOKEN_BUDGET", "0")) or None,
+        # 取值索引：Prompt 中给出问题提到的数据库取值，代替每列的示例值
+        value_index=os.getenv("VALUE_INDEX", "0").lower() in ("1", "true", "yes"),
+        value_index_dir=os.getenv(
+            "VALUE_INDEX_DIR", os.path.join(data_root, "cache", "values")
+        ) or None,
+        value_index_top=int(os.getenv("VALUE_INDEX_TOP", "8")),
+        # 执行前对照 Schema 静态检查生成的 SQL，未通过时直接交给 LLM 修复
+        sql_validation=os.getenv("SQL_VALIDATION", "1").lower() not in ("0", "false", "no"),
+        executor=ExecutorSpec(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "no"),
+            chunk_size=int(os.getenv("SQL_FETCH_CHUNK", "500")),
+            max_bytes=int(os.getenv("SQL_MAX_RESULT_BYTES", str(16 * 1024 * 1024))) or None,
+            timeout=float(os.getenv("SQL_TIMEOUT", "10")) or None,
+            max_vm_steps=int(os.getenv("SQL_MAX_VM_STEPS", "0")) or None,
+            max_cost=float(os.getenv("SQL_MAX_COST", "1e8")) or None,
+            cache_entries=int(os.getenv("SQL_RESULT_CACHE_ENTRIES", "256")),
+            cache_bytes=int(os.getenv("SQL_RESULT_CACHE_BYTES", str(64 * 1024 * 1024))),
+            cache_path=os.getenv("SQL_RESULT_CACHE_PATH") or None,
+        ),
+        # Web 端流式显示 SQL 草稿（单次生成，语句完整后立即校验与 EXPLAIN，不做复查调用）
+        stream_sql=os.getenv("STREAM_SQL", "1").lower() not in ("0", "false", "no"),
+        # always：每条草稿都发起复查调用；gated：本地检查（静态校验、EXPLAIN、常见错误模式）发现风险时才复查
+        review_mode=os.getenv("REVIEW_MODE", "always").lower(),
+        vector_index=VectorIndexSpec(
+            kind=os.getenv("VECTOR_INDEX", "flat").lower(),
+            nlist=int(os.getenv("IVF_NLIST", "256")),
+            nprobe=int(os.getenv("IVF_NPROBE", "16")),
+            hnsw_m=int(os.getenv("HNSW_M", "32")),
+            ef_construction=int(os.getenv("HNSW_EF_CONSTRUCTION", "200")),
+            ef_search=int(os.getenv("HNSW_EF_SEARCH", "64")),
+            pq_m=int(os.getenv("PQ_M", "16")),
+            pq_nbits=int(os.getenv("PQ_NBITS", "8")),
+        ),
+        fusion=FusionSpec(
+            method=os.getenv("FUSION_METHOD", "rrf").lower(),
+            semantic_weight=float(os.getenv("FUSION_SEMANTIC_WEIGHT", "0.5")),
+            rrf_k=int(os.getenv("RRF_K", "60")),
+        ),
+        self_consistency=SelfConsistencySpec(
+            candidates=int(os.getenv("SC_CANDIDATES", "1")),
+            temperature=float(os.getenv("SC_TEMPERATURE", "0.7")),
+            timeout=float(os.getenv("SC_TIMEOUT", "0")) or None,
+        ),
+        prompt_budget=PromptBudgetSpec(
+            total=int(os.getenv("PROMPT_TOKEN_BUDGET", "0")),
+            schema_share=float(os.getenv("PROMPT_SCHEMA_SHARE", "0.5")),
+            few_shot_share=float(os.getenv("PROMPT_FEW_SHOT_SHARE", "0.35")),
+            memory_share=float(os.getenv("PROMPT_MEMORY_SHARE", "0.15")),
+        ),
+        encoder_model=os.getenv("ENCODER_MODEL", "all-MiniLM-L6-v2"),
+        # torch / torch-int8 / onnx / onnx-int8
+        encoder_backend=os.getenv("ENCODER_BACKEND", "torch").lower(),
+        # onnx-int8 使用的量化文件（如 onnx/model_qint8_avx512.onnx），未设置时自动选择
+        encoder_onnx_file=os.getenv("ENCODER_ONNX_FILE") or None,
+        # LLM 响应缓存（SQLite 文件），未设置时不缓存；语义阈值设为 0 只保留精确缓存
+        llm_cache_path=os.getenv("LLM_CACHE_PATH") or None,
+        llm_cache_semantic_threshold=float(os.getenv("LLM_CACHE_SEMANTIC_THRESHOLD", "0")),
+        llm_cache_ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+        llm_cache_max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000")),
     )
@@ -16,11 +16,14 @@ def _load_json(path: str) -> list[dict]:
         return json.load(f)
 
 
-def load_examples(train_json: str, db_id: str) -> list[Example]:
+def load_examples(train_json: str, db_id: str | None) -> list[Example]:
+    """
+    db_id 为 None 时加载所有数据库的示例（多库语料）。
+    """
     data = _load_json(train_json)
     examples: list[Example] = []
     for item in data:
-        if item.get("db_id") != db_id:
+        if db_id is not None and item.get("db_id") != db_id:
             continue
         question = item.get("question", "").strip()
         sql = item.get("query", "").strip()
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import logging
+import threading
+
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+# 进程内共享的句向量模型：(模型名, 后端, ONNX 文件) -> 模型，首次使用时加载
+_ENCODERS: dict[tuple[str, str, str | None], SentenceTransformer] = {}
+_LOCK = threading.Lock()
+
+ENCODER_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+# sentence-transformers 官方模型仓库中预先量化好的 ONNX 文件，未指定时按顺序尝试；
+# 不同模型/CPU 架构提供的文件不同，都不存在时退回未量化的 ONNX 模型
+_ONNX_INT8_FILES = (
+    "onnx/model_qint8_avx512_vnni.onnx",
+    "onnx/model_qint8_avx512.onnx",
+    "onnx/model_quint8_avx2.onnx",
+    "onnx/model_qint8_arm64.onnx",
+)
+
+
+def get_encoder(
+    model_name: str, backend: str = "torch", onnx_file: str | None = None
+) -> SentenceTransformer:
+    """
+    返回共享的编码器实例，同一进程内多个检索器复用同一份模型。
+
+    backend:
+    - torch：默认 PyTorch 推理
+    - torch-int8：对 Linear 层做动态 int8 量化（仅 CPU）
+    - onnx / onnx-int8：ONNX Runtime 推理（需安装 optimum[onnxruntime]）；
+      onnx_file 指定 onnx-int8 使用的量化文件（模型仓库内的相对路径）
+    """
+    key = (model_name, backend, onnx_file)
+    encoder = _ENCODERS.get(key)
+    if encoder is not None:
+        return encoder
+    with _LOCK:
+        encoder = _ENCODERS.get(key)
+        if encoder is None:
+            encoder = _load_encoder(model_name, backend, onnx_file)
+            _ENCODERS[key] = encoder
+    return encoder
+
+
+def encoder_cache_name(model_name: str, backend: str) -> str:
+    """量化/ONNX 后端的向量与 PyTorch 略有差异，磁盘缓存需按后端区分。"""
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def _load_encoder(model_name: str, backend: str, onnx_file: str | None = None) -> SentenceTransformer:
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "torch-int8":
+        import torch
+
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+    if backend == "onnx-int8":
+        for file_name in (onnx_file,) if onnx_file else _ONNX_INT8_FILES:
+            try:
+                return SentenceTransformer(
+                    model_name, device="cpu", backend="onnx", model_kwargs={"file_name": file_name}
+                )
+            except ImportError:
+                raise
+            except Exception as e:
+                if onnx_file:
+                    raise
+                logger.info("ONNX 量化文件 %s 不可用: %s", file_name, e)
+        logger.warning("模型 %s 没有可用的 int8 ONNX 文件，改用未量化的 ONNX 模型", model_name)
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+    raise ValueError(f"未知的编码器后端: {backend}，可选: {', '.join(ENCODER_BACKENDS)}")
@@ -1,43 +1,150 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import os
 import time
+from dataclasses import replace
 from tqdm import tqdm
 
-from .config import load_config
+from .compare import canonicalize, compare_canonical, is_ordered
+from .config import FusionSpec, PromptBudgetSpec, SelfConsistencySpec, VectorIndexSpec, load_config
 from .data_loader import load_examples, load_gold_sql, load_questions
     # 修正：直接从 test.json 加载 SQL 以保证对齐
+from .gold_store import GoldResult, GoldStore
 from .llm import LLMClient
+from .llm_cache import LLMResponseCache, build_llm_cache
 from .prompt import build_prompt
 from .retrieval import HybridRetriever
-from .schema import get_schema
-from .sql_executor import execute_sql
+from .review_gate import RiskGate
+from .schema import load_catalog
+from .schema_linking import SchemaLinker
+from .self_consistency import agenerate_and_vote
+from .sql_executor import configure_executor, execute_sql, get_executor
+from .sql_validator import SQLValidator, format_issues
+from .tokenizer import estimate_tokens, tokenizer_name
+from .value_index import ValueIndex
 
 
-def _normalize_val(v):
-    if v is None: return None
-    if isinstance(v, (int, float)): return float(v)
-    return str(v).strip().lower()
+async def _evaluate_one(
+    llm: LLMClient,
+    db_path: str,
+    prompt: str,
+    question: str,
+    gold_sql: str,
+    gold: GoldResult | None,
+    validator: SQLValidator | None = None,
+    self_consistency: SelfConsistencySpec | None = None,
+    review_gate: RiskGate | None = None,
+) -> dict:
+    question_start = time.time()
+    pred_sql = ""
+    step_time = 0.0
+    is_correct = False
+    error_msg = None
+    votes = None
+    try:
+        step_start = time.time()
+        failure = None
+        pred_res = None
+        if self_consistency is not None and self_consistency.enabled:
+            # 候选的生成与执行都在投票内完成，全部失败时再走修复
+            vote = await agenerate_and_vote(llm, db_path, prompt, self_consistency, validator)
+            pred_sql, pred_res, failure = vote.sql, vote.result, vote.error
+            votes = (vote.votes, len(vote.candidates))
+            step_time = time.time() - step_start
+        else:
+            pred_sql = await llm.agenerate_sql(prompt, review_gate)
+            step_time = time.time() - step_start
 
-def _compare_results(pred: list[tuple], gold: list[tuple]) -> bool:
-    if not pred and not gold: return True
-    if not pred or not gold: return False
-    if len(pred) != len(gold): return False
-    
-    norm_pred = [tuple(_normalize_val(x) for x in row) for row in pred]
-    norm_gold = [tuple(_normalize_val(x) for x in row) for row in gold]
-    
-    if set(norm_pred) == set(norm_gold): return True
-    
-    import itertools
-    num_cols = len(norm_gold[0])
-    if num_cols <= 4:
-        gold_set = set(norm_gold)
-        for p in itertools.permutations(range(num_cols)):
-            permuted_pred = set(tuple(row[i] for i in p) for row in norm_pred)
-            if permuted_pred == gold_set: return True
-    return False
+            # 静态检查不通过时不必执行，直接带着结构化错误修复
+            if validator is not None:
+                issues = validator.validate(pred_sql)
+                if issues:
+                    failure = format_issues(issues)
+        if failure is None and pred_res is None:
+            try:
+                pred_res = await asyncio.to_thread(execute_sql, db_path, pred_sql)
+            except Exception as e:
+                failure = str(e)
+        if failure is not None:
+            # Execution-guided self-correction (retry once)
+            pred_sql = await llm.arepair_sql(prompt, pred_sql, failure)
+            pred_res = await asyncio.to_thread(execute_sql, db_path, pred_sql)
+        if gold is None:
+            gold_res = await asyncio.to_thread(execute_sql, db_path, gold_sql, max_cost=0)
+            gold_canonical = canonicalize(gold_res.rows, ordered=is_ordered(gold_sql))
+        elif gold.error:
+            raise RuntimeError(gold.error)
+        else:
+            gold_canonical = gold.canonical
+        pred_canonical = canonicalize(pred_res.rows, ordered=gold_canonical.ordered)
+        is_correct = compare_canonical(pred_canonical, gold_canonical)
+    except Exception as e:
+        error_msg = str(e)
+
+    return {
+        "question": question,
+        "gold_sql": gold_sql,
+        "pred_sql": pred_sql,
+        "is_correct": is_correct,
+        "time": step_time,
+        "latency": time.time() - question_start,
+        "error": error_msg,
+        "votes": votes,
+    }
+
+
+async def _run_all(
+    llm: LLMClient,
+    db_path: str,
+    schema_text: str,
+    questions: list[str],
+    gold_sqls: list[str],
+    few_shots: list[list],
+    workers: int,
+    gold_store: GoldStore | None = None,
+    linker: SchemaLinker | None = None,
+    value_index: ValueIndex | None = None,
+    validator: SQLValidator | None = None,
+    self_consistency: SelfConsistencySpec | None = None,
+    budget: PromptBudgetSpec | None = None,
+    review_gate: RiskGate | None = None,
+) -> list[dict]:
+    """
+    以最多 workers 个问题并发评测；结果按原题目顺序返回，与串行执行一致。
+    """
+    semaphore = asyncio.Semaphore(max(workers, 1))
+    progress = tqdm(total=len(questions))
+
+    async def run(question: str, gold_sql: str, few_shot: list) -> dict:
+        async with semaphore:
+            value_hits = value_index.lookup(question) if value_index is not None else None
+            # full_prompt 为不裁剪、不限预算的基线，只用于统计节省的 token
+            full_prompt = build_prompt(schema_text, few_shot, question, value_hits=value_hits)
+            schema = schema_text
+            if linker is not None:
+                schema = (await asyncio.to_thread(linker.link, question, few_shot)).text
+            prompt = build_prompt(schema, few_shot, question, value_hits=value_hits, budget=budget)
+            gold = gold_store.get(gold_sql) if gold_store is not None else None
+            result = await _evaluate_one(
+                llm, db_path, prompt, question, gold_sql, gold, validator, self_consistency,
+                review_gate,
+            )
+            result["prompt_tokens"] = estimate_tokens(prompt)
+            result["full_prompt_tokens"] = estimate_tokens(full_prompt)
+        progress.update(1)
+        return result
+
+    try:
+        results = await asyncio.gather(
+            *(run(q, g, f) for q, g, f in zip(questions, gold_sqls, few_shots))
+        )
+    finally:
+        progress.close()
+    for i, res in enumerate(results):
+        res["id"] = i + 1
+    return results
 
 
 def evaluate(
@@ -49,12 +156,58 @@ def evaluate(
     base_url: str | None,
     top_k: int,
     limit: int | None,
+    tfidf_max_df: float = 1.0,
+    index_cache_dir: str | None = None,
+    index_spec: VectorIndexSpec | None = None,
+    fusion: FusionSpec | None = None,
+    encoder_model: str = "all-MiniLM-L6-v2",
+    encoder_backend: str = "torch",
+    encoder_onnx_file: str | None = None,
+    llm_cache: LLMResponseCache | None = None,
+    workers: int = 1,
+    rps: float | None = None,
+    gold_store_dir: str | None = None,
+    schema_cache_dir: str | None = None,
+    schema_sample_rows: int = 1000,
+    schema_linking: bool = False,
+    schema_token_budget: int | None = None,
+    value_index_dir: str | None = None,
+    use_value_index: bool = False,
+    value_index_top: int = 8,
+    sql_validation: bool = True,
+    self_consistency: SelfConsistencySpec | None = None,
+    prompt_budget: PromptBudgetSpec | None = None,
+    review_mode: str = "always",
 ) -> None:
-    schema_text = get_schema(db_path)
+    catalog = load_catalog(db_path, schema_cache_dir, schema_sample_rows)
+    value_index = None
+    if use_value_index:
+        # 取值索引命中代替每列的示例值
+        value_index = ValueIndex.load(db_path, value_index_dir, value_index_top)
+    schema_text = catalog.to_text(with_samples=value_index is None)
+    validator = SQLValidator(catalog) if sql_validation else None
     examples = load_examples(train_json, "college_2")
     
     print("正在初始化混合检索索引...")
-    retriever = HybridRetriever(examples)
+    retriever = HybridRetriever(
+        examples,
+        model_name=encoder_model,
+        encoder_backend=encoder_backend,
+        onnx_file=encoder_onnx_file,
+        tfidf_max_df=tfidf_max_df,
+        cache_dir=index_cache_dir,
+        index_spec=index_spec,
+        fusion=fusion,
+    )
+
+    linker = None
+    if schema_linking:
+        linker = SchemaLinker(
+            catalog,
+            encode=retriever.encode,
+            token_budget=schema_token_budget or (prompt_budget.schema_tokens if prompt_budget else None),
+            with_samples=value_index is None,
+        )
 
     questions = load_questions(test_json, "college_2")
     gold_sqls = load_gold_sql(test_json, "college_2")
@@ -68,56 +221,90 @@ def evaluate(
         gold_sqls = gold_sqls[:limit]
         total = len(questions)
 
-    llm = LLMClient(model_name=model_name, api_key=api_key, base_url=base_url, temperature=0.0)
+    # 批量检索：所有问题一次编码，避免逐条前向
+    few_shots = retriever.search_many(questions, k=top_k)
 
-    correct = 0
-    start_time = time.time()
-    results_detail = []
+    # 标准 SQL 结果按数据库指纹预计算一次，之后的评测只需执行预测 SQL
+    gold_store = None
+    if gold_store_dir:
+        gold_store = GoldStore(gold_store_dir, db_path)
+        computed = gold_store.precompute(gold_sqls)
+        print(f"标准结果预计算: 新增 {computed} 条，复用 {len(gold_sqls) - computed} 条")
 
-    for i, (question, gold_sql) in enumerate(tqdm(list(zip(questions, gold_sqls))[:total])):
-        few_shot = retriever.search(question, k=top_k)
-        prompt = build_prompt(schema_text, few_shot, question)
-        
-        step_start = time.time()
-        pred_sql = llm.generate_sql(prompt)
-        step_time = time.time() - step_start
-        
-        is_correct = False
-        error_msg = None
-        try:
-            try:
-                pred_res = execute_sql(db_path, pred_sql)
-            except Exception as e:
-                # Execution-guided self-correction (retry once)
-                pred_sql = llm.repair_sql(prompt, pred_sql, str(e))
-                pred_res = execute_sql(db_path, pred_sql)
-            gold_res = execute_sql(db_path, gold_sql)
-            if _compare_results(pred_res.rows, gold_res.rows):
-                correct += 1
-                is_correct = True
-        except Exception as e:
-            error_msg = str(e)
-
-        results_detail.append({
-            "id": i + 1,
-            "question": question,
-            "gold_sql": gold_sql,
-            "pred_sql": pred_sql,
-            "is_correct": is_correct,
-            "time": step_time,
-            "error": error_msg
-        })
-
-    elapsed = time.time() - start_time
+    # review_mode=both 时依次评测两种复查方式，明细输出最后一次（gated）。
+    # 为公平比较，每种方式用新的 LLM 客户端（用量分开统计），且不使用 LLM 响应缓存与结果缓存，
+    # 否则第二种方式会直接命中第一种留下的修复/执行结果
+    modes = ["always", "gated"] if review_mode == "both" else [review_mode]
+    comparing = len(modes) > 1
+    executor = get_executor()
+    result_cache = executor.cache
+    if comparing:
+        llm_cache = None
+        executor.cache = None
+    review_lines = []
+    usage_lines = []
+    try:
+        for mode in modes:
+            llm = LLMClient(
+                model_name=model_name,
+                api_key=api_key,
+                base_url=base_url,
+                temperature=0.0,
+                cache=llm_cache,
+                max_concurrency=workers,
+                requests_per_second=rps,
+            )
+            review_gate = RiskGate(db_path, validator) if mode == "gated" else None
+            start_time = time.time()
+            results_detail = asyncio.run(
+                _run_all(
+                    llm, db_path, schema_text, questions, gold_sqls, few_shots, workers, gold_store, linker,
+                    value_index, validator, self_consistency, prompt_budget, review_gate,
+                )
+            )
+            elapsed = time.time() - start_time
+            mode_correct = sum(1 for res in results_detail if res["is_correct"])
+            mode_latency = sum(res["latency"] for res in results_detail) / max(total, 1)
+            line = (
+                f"复查方式 {mode}: 准确率 {mode_correct / total if total else 0.0:.4f}, "
+                f"平均响应 {mode_latency:.2f}s, 总耗时 {elapsed:.1f}s"
+            )
+            if review_gate is not None:
+                line += f", {review_gate.stats()}"
+            review_lines.append(line)
+            usage_lines.append(f"{mode} {llm.usage.stats()}" if comparing else llm.usage.stats())
+    finally:
+        executor.cache = result_cache
+
+    correct = sum(1 for res in results_detail if res["is_correct"])
     accuracy = correct / total if total else 0.0
-    avg_time = elapsed / max(total, 1)
+    avg_time = sum(res["latency"] for res in results_detail) / max(total, 1)
+    throughput = total / elapsed if elapsed > 0 else 0.0
+    prompt_tokens = sum(res["prompt_tokens"] for res in results_detail) / max(total, 1)
+    full_prompt_tokens = sum(res["full_prompt_tokens"] for res in results_detail) / max(total, 1)
+    token_saving = 1 - prompt_tokens / full_prompt_tokens if full_prompt_tokens else 0.0
+    max_prompt_tokens = max((res["prompt_tokens"] for res in results_detail), default=0)
+    token_line = (
+        f"平均 Prompt tokens: {prompt_tokens:.0f}, 最大 {max_prompt_tokens} (完整 Schema {full_prompt_tokens:.0f}, "
+        f"节省 {token_saving:.1%}, Schema 裁剪: {'开' if linker is not None else '关'}, "
+        f"预算: {prompt_budget.label if prompt_budget is not None else '不限'}, 分词: {tokenizer_name()})"
+    )
+    sc_label = self_consistency.label if self_consistency is not None else "关"
+    voted = [res["votes"] for res in results_detail if res["votes"]]
+    if voted:
+        agreement = sum(v / n for v, n in voted) / len(voted)
+        sc_label += f", 平均一致率 {agreement:.1%}"
+    sc_line = f"自洽投票: {sc_label}"
     
     print("\n" + "="*50)
-    print(f"{'ID':<4} | {'状态':<4} | {'耗时':<6} | {'问题'}")
+    print(f"{'ID':<4} | {'状态':<4} | {'耗时':<6} | {'Prompt':<9} | {'问题'}")
     print("-" * 50)
     for res in results_detail:
         status_str = "✅" if res["is_correct"] else "❌"
-        print(f"{res['id']:<4} | {status_str:<4} | {res['time']:>5.2f}s | {res['question'][:50]}...")
+        print(
+            f"{res['id']:<4} | {status_str:<4} | {res['time']:>5.2f}s | {res['prompt_tokens']:>5} tok"
+            f" | {res['question'][:50]}..."
+        )
         if not res["is_correct"]:
             print(f"   - 预测SQL: {res['pred_sql']}")
             print(f"   - 标准SQL: {res['gold_sql']}")
@@ -126,15 +313,37 @@ def evaluate(
 
     print(f"执行准确率: {accuracy:.4f} ({correct}/{total})")
     print(f"平均响应时间: {avg_time:.2f}s")
+    print(f"吞吐量: {throughput:.2f} 题/秒 (并发 {workers}, 总耗时 {elapsed:.1f}s)")
+    print(f"检索融合: {retriever.fusion.label}")
+    print(token_line)
+    print(sc_line)
+    for line in review_lines:
+        print(line)
+    usage_line = f"模型调用用量: {'; '.join(usage_lines)}"
+    print(usage_line)
+    if llm_cache is not None:
+        print(f"LLM 缓存: {llm_cache.stats()}")
     
     with open("eval_report.txt", "w", encoding="utf-8") as f:
         f.write(f"评测时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"模型: {model_name} | Top-K: {top_k}\n")
+        f.write(
+            f"模型: {model_name} | Top-K: {top_k} | 向量索引: {retriever.index_spec.cache_name}"
+            f" | 融合: {retriever.fusion.label}\n"
+        )
         f.write(f"执行准确率: {accuracy:.4f} ({correct}/{total})\n")
         f.write(f"平均响应时间: {avg_time:.2f}s\n")
+        f.write(f"吞吐量: {throughput:.2f} 题/秒 (并发 {workers}, 总耗时 {elapsed:.1f}s)\n")
+        f.write(token_line + "\n")
+        f.write(sc_line + "\n")
+        for line in review_lines:
+            f.write(line + "\n")
+        f.write(usage_line + "\n")
         f.write("-" * 30 + "\n")
         for res in results_detail:
-            f.write(f"ID: {res['id']} | {'PASS' if res['is_correct'] else 'FAIL'} | Time: {res['time']:.2f}s\n")
+            f.write(
+                f"ID: {res['id']} | {'PASS' if res['is_correct'] else 'FAIL'} | Time: {res['time']:.2f}s"
+                f" | Tokens: {res['prompt_tokens']}\n"
+            )
             f.write(f"Q: {res['question']}\n")
             f.write(f"Pred: {res['pred_sql']}\n")
             f.write(f"Gold: {res['gold_sql']}\n")
@@ -152,8 +361,47 @@ def main() -> None:
     parser.add_argument("--top_k", type=int, default=config.top_k_examples)
     parser.add_argument("--limit", type=int, default=None)
     parser.add_argument("--use_train_set", action="store_true")
+    parser.add_argument("--workers", "--concurrency", type=int, default=1, help="并发评测的问题数")
+    parser.add_argument("--rps", type=float, default=None, help="每秒最多发起的 LLM 请求数")
+    parser.add_argument("--fusion", choices=["rrf", "weighted"], default=config.fusion.method)
+    parser.add_argument("--semantic_weight", type=float, default=config.fusion.semantic_weight)
+    parser.add_argument(
+        "--schema_linking", action=argparse.BooleanOptionalAction, default=config.schema_linking,
+        help="按问题裁剪 Schema，只保留相关表",
+    )
+    parser.add_argument(
+        "--value_index", action=argparse.BooleanOptionalAction, default=config.value_index,
+        help="在 Prompt 中给出问题提到的数据库取值，代替示例值",
+    )
+    parser.add_argument(
+        "--sc_candidates", type=int, default=config.self_consistency.candidates,
+        help="自洽投票的候选 SQL 数，<=1 关闭",
+    )
+    parser.add_argument(
+        "--sc_timeout", type=float, default=config.self_consistency.timeout,
+        help="等待候选 SQL 的最长秒数",
+    )
+    parser.add_argument(
+        "--prompt_budget", type=int, default=config.prompt_budget.total,
+        help="整条 Prompt 的 token 上限（按比例分给 Schema/示例/记忆），0 不限制",
+    )
+    parser.add_argument(
+        "--review", choices=["always", "gated", "both"], default=config.review_mode,
+        help="复查调用方式：always 每次复查，gated 本地检查发现风险才复查，both 两者都评测并对比",
+    )
+    parser.add_argument(
+        "--sql_timeout", type=float, default=config.executor.timeout, help="单条 SQL 的执行超时（秒），0 不限制",
+    )
+    parser.add_argument(
+        "--sql_max_cost", type=float, default=config.executor.max_cost,
+        help="EXPLAIN 预估代价上限，超过时拒绝执行，0 关闭检查",
+    )
+    parser.add_argument("--schema_budget", type=int, default=config.schema_token_budget, help="Schema 的 token 上限")
     args = parser.parse_args()
 
+    configure_executor(
+        replace(config.executor, timeout=args.sql_timeout or None, max_cost=args.sql_max_cost or None)
+    )
     eval_json = config.train_json if args.use_train_set else config.test_json
     print(f"正在使用 {'训练集' if args.use_train_set else '测试集'} 进行评测...")
 
@@ -166,6 +414,30 @@ def main() -> None:
         base_url=args.base_url,
         top_k=args.top_k,
         limit=args.limit,
+        tfidf_max_df=config.tfidf_max_df,
+        index_cache_dir=config.index_cache_dir,
+        index_spec=config.vector_index,
+        fusion=replace(config.fusion, method=args.fusion, semantic_weight=args.semantic_weight),
+        encoder_model=config.encoder_model,
+        encoder_backend=config.encoder_backend,
+        encoder_onnx_file=config.encoder_onnx_file,
+        llm_cache=build_llm_cache(config),
+        workers=args.workers,
+        rps=args.rps,
+        gold_store_dir=config.gold_store_dir,
+        schema_cache_dir=config.schema_cache_dir,
+        schema_sample_rows=config.schema_sample_rows,
+        schema_linking=args.schema_linking,
+        schema_token_budget=args.schema_budget,
+        value_index_dir=config.value_index_dir,
+        use_value_index=args.value_index,
+        value_index_top=config.value_index_top,
+        sql_validation=config.sql_validation,
+        prompt_budget=replace(config.prompt_budget, total=args.prompt_budget),
+        review_mode=args.review,
+        self_consistency=replace(
+            config.self_consistency, candidates=args.sc_candidates, timeout=args.sc_timeout or None
+        ),
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+
+from .compare import CanonicalResult, canonicalize, is_ordered
+from .config import load_config
+from .data_loader import load_gold_sql
+from .sql_executor import db_fingerprint, execute_sql, normalize_sql
+
+
+# 存储格式变化时递增，旧文件自动失效
+_FORMAT_VERSION = 2
+
+
+@dataclass(frozen=True)
+class GoldResult:
+    columns: list[str]
+    # 归一化后的规范形式，评测时直接与预测结果的规范形式比较
+    canonical: CanonicalResult | None
+    # 标准 SQL 执行失败时的错误信息
+    error: str | None = None
+
+
+def _sql_key(sql: str) -> str:
+    return hashlib.sha1(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+class GoldStore:
+    """
+    标准 SQL 执行结果的预计算存储：每个数据库指纹一个 gzip JSON 文件，
+    保存结果集的规范形式（列签名、规范化行、摘要、是否有序）。数据库文件变化后指纹改变，自动重新计算。
+    """
+
+    def __init__(self, store_dir: str, db_path: str):
+        self.db_path = db_path
+        fingerprint = f"{db_fingerprint(db_path) or db_path}:v{_FORMAT_VERSION}"
+        name = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(store_dir, f"gold-{name}.json.gz")
+        self._entries: dict[str, GoldResult] = {}
+        self._dirty = False
+        if os.path.exists(self.path):
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for key, item in json.load(f).items():
+                    canonical = None
+                    if item.get("error") is None:
+                        canonical = CanonicalResult(
+                            rows=tuple(tuple(r) for r in item["rows"]),
+                            column_signatures=tuple(item["column_signatures"]),
+                            ordered=item["ordered"],
+                            digest=item["digest"],
+                        )
+                    self._entries[key] = GoldResult(
+                        columns=item["columns"], canonical=canonical, error=item.get("error")
+                    )
+
+    def get(self, sql: str) -> GoldResult | None:
+        return self._entries.get(_sql_key(sql))
+
+    def precompute(self, gold_sqls: list[str]) -> int:
+        """执行尚未缓存的标准 SQL 并写回磁盘，返回新计算的条数。"""
+        computed = 0
+        for sql in gold_sqls:
+            key = _sql_key(sql)
+            if key in self._entries:
+                continue
+            try:
+                # 标准 SQL 必须执行，不做代价检查
+                result = execute_sql(self.db_path, sql, max_cost=0)
+                canonical = canonicalize(result.rows, ordered=is_ordered(sql))
+                entry = GoldResult(columns=result.columns, canonical=canonical)
+            except Exception as e:
+                entry = GoldResult(columns=[], canonical=None, error=str(e))
+            self._entries[key] = entry
+            self._dirty = True
+            computed += 1
+        self.save()
+        return computed
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        payload = {}
+        for key, entry in self._entries.items():
+            item = {"columns": entry.columns, "error": entry.error}
+            if entry.canonical is not None:
+                item.update(
+                    rows=[list(r) for r in entry.canonical.rows],
+                    column_signatures=list(entry.canonical.column_signatures),
+                    ordered=entry.canonical.ordered,
+                    digest=entry.canonical.digest,
+                )
+            payload[key] = item
+        tmp_path = self.path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def main() -> None:
+    config = load_config()
+    parser = argparse.ArgumentParser(description="预计算标准 SQL 的执行结果")
+    parser.add_argument("--db_path", default=config.db_path)
+    parser.add_argument("--store_dir", default=config.gold_store_dir)
+    args = parser.parse_args()
+
+    store = GoldStore(args.store_dir, args.db_path)
+    gold_sqls = load_gold_sql(config.test_json, "college_2") + load_gold_sql(config.train_json, "college_2")
+    computed = store.precompute(gold_sqls)
+    print(f"已预计算 {computed} 条标准 SQL 结果（共 {len(gold_sqls)} 条）: {store.path}")
+
+
+if __name__ == "__main__":
+    main()
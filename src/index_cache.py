@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Sequence
+
+import faiss
+import numpy as np
+
+
+# 同一模型下保留的语料目录数（含当前），更早未被复用的目录在新建缓存后删除
+_KEEP_CORPORA = 3
+
+
+def _text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _atomic_write(path: str, write: Callable[[str], None]) -> None:
+    """先写入同目录临时文件再 rename，避免并发进程读到半截文件。"""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class IndexCache:
+    """
+    检索索引的磁盘缓存，按 (示例内容哈希, 模型名) 做内容寻址：
+
+        <cache_dir>/<model>/<corpus_key>/keys.json        每条示例问题的哈希
+                                        /embeddings.npy    向量（mmap 读取）
+                                        /vector-*.faiss    FAISS 索引
+                                        /tfidf-*.npz       TF-IDF 统计
+
+    示例有少量变动时，从同模型最近一次的缓存中按问题哈希复用已有向量，只编码新增部分。
+    每次命中会刷新目录的使用时间；新建缓存成功后只保留最近使用的 _KEEP_CORPORA 个目录，避免无限增长。
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, texts: Sequence[str]):
+        self.model_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        self.keys = [_text_key(t) for t in texts]
+        self.texts = list(texts)
+
+        digest = hashlib.sha256(model_name.encode("utf-8"))
+        for key in self.keys:
+            digest.update(key.encode("ascii"))
+        self.corpus_key = digest.hexdigest()[:16]
+        self.corpus_dir = os.path.join(self.model_dir, self.corpus_key)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.corpus_dir, name)
+
+    def load_embeddings(self, encode: Callable[[list[str]], np.ndarray]) -> np.ndarray:
+        """返回与 texts 对齐的 float32 向量矩阵（只读 mmap）；缺失部分调用 encode 计算。"""
+        emb_path = self.path("embeddings.npy")
+        if os.path.exists(emb_path):
+            self._touch()
+            return np.load(emb_path, mmap_mode="r")
+
+        reused = self._previous_embeddings()
+        missing = [i for i, key in enumerate(self.keys) if key not in reused]
+        fresh = encode([self.texts[i] for i in missing]) if missing else None
+
+        embeddings: np.ndarray | None = None
+        fresh_pos = {idx: pos for pos, idx in enumerate(missing)}
+        for i, key in enumerate(self.keys):
+            row = fresh[fresh_pos[i]] if i in fresh_pos else reused[key]
+            if embeddings is None:
+                embeddings = np.empty((len(self.keys), row.shape[0]), dtype=np.float32)
+            embeddings[i] = row
+        if embeddings is None:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        os.makedirs(self.corpus_dir, exist_ok=True)
+        _atomic_write(emb_path, lambda p: _save_npy(p, embeddings))
+        _atomic_write(self.path("keys.json"), lambda p: _save_json(p, self.keys))
+        self.prune()
+        return np.load(emb_path, mmap_mode="r")
+
+    def _touch(self) -> None:
+        try:
+            os.utime(self.path("keys.json"))
+        except OSError:
+            pass
+
+    def prune(self, keep: int = _KEEP_CORPORA) -> list[str]:
+        """删除同模型下除当前目录外、最近未被使用的语料目录，返回被删除的目录名。"""
+        if not os.path.isdir(self.model_dir):
+            return []
+        others = []
+        for name in os.listdir(self.model_dir):
+            path = os.path.join(self.model_dir, name)
+            if name == self.corpus_key or not os.path.isdir(path):
+                continue
+            keys_path = os.path.join(path, "keys.json")
+            mtime = os.path.getmtime(keys_path if os.path.exists(keys_path) else path)
+            others.append((mtime, name))
+        removed = [name for _, name in sorted(others, reverse=True)[max(keep - 1, 0):]]
+        for name in removed:
+            shutil.rmtree(os.path.join(self.model_dir, name), ignore_errors=True)
+        return removed
+
+    def _previous_embeddings(self) -> dict[str, np.ndarray]:
+        """同一模型下最近一次缓存的 {问题哈希: 向量}，用于增量更新。"""
+        if not os.path.isdir(self.model_dir):
+            return {}
+        candidates = []
+        for name in os.listdir(self.model_dir):
+            keys_path = os.path.join(self.model_dir, name, "keys.json")
+            if name != self.corpus_key and os.path.exists(keys_path):
+                candidates.append((os.path.getmtime(keys_path), name))
+        if not candidates:
+            return {}
+        latest = os.path.join(self.model_dir, max(candidates)[1])
+        try:
+            with open(os.path.join(latest, "keys.json"), "r", encoding="utf-8") as f:
+                keys = json.load(f)
+            embeddings = np.load(os.path.join(latest, "embeddings.npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            return {}
+        wanted = set(self.keys)
+        return {key: embeddings[i] for i, key in enumerate(keys) if key in wanted}
+
+    def load_vector_index(self, name: str, build: Callable[[], faiss.Index]) -> faiss.Index:
+        index_path = self.path(f"vector-{name}.faiss")
+        if os.path.exists(index_path):
+            return faiss.read_index(index_path)
+        index = build()
+        os.makedirs(self.corpus_dir, exist_ok=True)
+        _atomic_write(index_path, lambda p: faiss.write_index(index, p))
+        return index
+
+    def load_npz(self, name: str, build: Callable[[], dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+        npz_path = self.path(f"{name}.npz")
+        if os.path.exists(npz_path):
+            with np.load(npz_path) as data:
+                return {k: data[k] for k in data.files}
+        arrays = build()
+        os.makedirs(self.corpus_dir, exist_ok=True)
+        _atomic_write(npz_path, lambda p: _save_npz(p, arrays))
+        return arrays
+
+
+def _save_npy(path: str, array: np.ndarray) -> None:
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def _save_npz(path: str, arrays: dict[str, np.ndarray]) -> None:
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def _save_json(path: str, obj) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import replace
+
+import faiss
+import numpy as np
+
+from .config import VectorIndexSpec, load_config
+from .data_loader import load_examples, load_questions
+from .retrieval import HybridRetriever, _apply_search_params, _effective_spec, build_vector_index
+
+# 每种索引类型要扫描的检索参数
+_SEARCH_GRID = {
+    "flat": [None],
+    "ivf": [1, 4, 16, 64],
+    "hnsw": [16, 32, 64, 128],
+    "ivfpq": [1, 4, 16, 64],
+}
+
+
+def _with_search_param(spec: VectorIndexSpec, value: int | None) -> VectorIndexSpec:
+    if value is None:
+        return spec
+    if spec.kind == "hnsw":
+        return replace(spec, ef_search=value)
+    return replace(spec, nprobe=value)
+
+
+def _search_param_label(index: faiss.Index) -> str:
+    # 读取实际生效的参数（nprobe 会被截断到 nlist）
+    if isinstance(index, faiss.IndexHNSW):
+        return f"efSearch={index.hnsw.efSearch}"
+    if isinstance(index, faiss.IndexIVF):
+        return f"nprobe={index.nprobe}"
+    return "-"
+
+
+def index_report(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    base_spec: VectorIndexSpec,
+    kinds: list[str],
+    k: int,
+) -> list[dict]:
+    """
+    以 flat 精确检索为基准，统计各索引配置的 recall@k、构建耗时与单条查询平均耗时。
+    """
+    k = min(k, len(embeddings))
+    truth_index = build_vector_index(embeddings, VectorIndexSpec(kind="flat"))
+    _, truth = truth_index.search(queries, k)
+
+    rows = []
+    for kind in kinds:
+        spec = _effective_spec(replace(base_spec, kind=kind), len(embeddings))
+        build_start = time.perf_counter()
+        index = build_vector_index(embeddings, spec)
+        build_time = time.perf_counter() - build_start
+
+        for value in _SEARCH_GRID.get(spec.kind, [None]):
+            tuned = _with_search_param(spec, value)
+            _apply_search_params(index, tuned)
+            found = np.empty_like(truth)
+            search_start = time.perf_counter()
+            for i in range(len(queries)):
+                _, found[i] = index.search(queries[i : i + 1], k)
+            latency = (time.perf_counter() - search_start) / max(len(queries), 1)
+
+            hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+            rows.append({
+                "index": tuned.cache_name,
+                "requested": kind,
+                "search": _search_param_label(index),
+                "recall": hits / max(truth.size, 1),
+                "latency_ms": latency * 1000,
+                "build_s": build_time,
+            })
+    return rows
+
+
+def main() -> None:
+    config = load_config()
+    parser = argparse.ArgumentParser(description="向量索引召回率/延迟报告（以 flat 为基准）")
+    parser.add_argument("--db_id", default="college_2", help="示例所属数据库，'*' 表示全部")
+    parser.add_argument("--kinds", default="flat,ivf,hnsw,ivfpq")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", default="index_report.txt")
+    args = parser.parse_args()
+
+    db_id = None if args.db_id == "*" else args.db_id
+    examples = load_examples(config.train_json, db_id)
+    retriever = HybridRetriever(
+        examples,
+        model_name=config.encoder_model,
+        encoder_backend=config.encoder_backend,
+        onnx_file=config.encoder_onnx_file,
+        tfidf_max_df=config.tfidf_max_df,
+        cache_dir=config.index_cache_dir,
+        index_spec=config.vector_index,
+    )
+    questions = load_questions(config.test_json, db_id) if db_id else []
+    if not questions:
+        questions = [ex.question for ex in examples]
+    queries = retriever.encode(questions)
+    embeddings = np.ascontiguousarray(retriever.embeddings, dtype=np.float32)
+    faiss.omp_set_num_threads(1)
+
+    rows = index_report(
+        embeddings, queries, config.vector_index, args.kinds.split(","), args.k
+    )
+
+    header = f"语料: {len(embeddings)} 条 | 查询: {len(queries)} 条 | recall@{args.k} 以 flat 为基准"
+    lines = [header, "-" * len(header)]
+    lines.append(f"{'索引':<28} | {'检索参数':<14} | {'recall':>6} | {'延迟(ms)':>8} | {'构建(s)':>7}")
+    for row in rows:
+        name = row["index"] if row["index"].startswith(row["requested"]) else f"{row['index']} (退化)"
+        lines.append(
+            f"{name:<28} | {row['search']:<14} | {row['recall']:>6.3f} | "
+            f"{row['latency_ms']:>8.3f} | {row['build_s']:>7.2f}"
+        )
+    report = "\n".join(lines)
+    print(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,23 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import os
+import random
 import re
+import threading
+import time
+import weakref
+from typing import Callable, Generator, Iterator
 
+import httpx
+import openai
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 
+from .llm_cache import LLMResponseCache, hash_text
+from .sql_validator import is_query, parse_select
+
 
 _SELECT_DISTINCT_RE = re.compile(r"(?is)^\s*select\s+distinct\s+")
 _PREREQ_EQ_SUBQUERY_RE = re.compile(
@@ -12,6 +25,139 @@ _PREREQ_EQ_SUBQUERY_RE = re.compile(
 )
 
 
+# 同一 base_url 的 LLMClient 共享 HTTP 连接池（Streamlit 每次提问都会新建 LLMClient）
+_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=16)
+_HTTP_CLIENTS: dict[str | None, httpx.Client] = {}
+# httpx.AsyncClient 的连接池绑定创建时的事件循环（每次 asyncio.run 都是新循环），按 (循环, base_url) 分别创建
+_ASYNC_HTTP_CLIENTS: dict[tuple[asyncio.AbstractEventLoop, str | None], httpx.AsyncClient] = {}
+_HTTP_LOCK = threading.Lock()
+
+
+def _shared_http_client(base_url: str | None) -> httpx.Client:
+    with _HTTP_LOCK:
+        client = _HTTP_CLIENTS.get(base_url)
+        if client is None:
+            client = _HTTP_CLIENTS[base_url] = httpx.Client(limits=_HTTP_LIMITS)
+        return client
+
+
+def _shared_async_http_client(base_url: str | None) -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    with _HTTP_LOCK:
+        client = _ASYNC_HTTP_CLIENTS.get((loop, base_url))
+        if client is None:
+            # 已关闭循环上的客户端不能再用，顺带丢弃
+            for key in [k for k in _ASYNC_HTTP_CLIENTS if k[0].is_closed()]:
+                del _ASYNC_HTTP_CLIENTS[key]
+            client = _ASYNC_HTTP_CLIENTS[(loop, base_url)] = httpx.AsyncClient(limits=_HTTP_LIMITS)
+        return client
+
+
+class _RateLimiter:
+    """按固定间隔发放请求时间槽，线程与协程共用。"""
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+            return slot - now
+
+    def wait(self) -> None:
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def await_slot(self) -> None:
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _backoff(attempt: int) -> float:
+    # 指数退避 + 抖动：1s, 2s, 4s ...，上限 30s
+    return min(30.0, 2.0 ** attempt) * (0.5 + random.random() / 2)
+
+
+class TokenUsage:
+    """
+    累计模型调用的输入 token 数及其中命中服务端前缀缓存（context caching）的部分。
+    cached 取 usage_metadata 的 cache_read（OpenAI 的 cached_tokens），
+    没有时取 DeepSeek 的 prompt_cache_hit_tokens。
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        # 最近一次调用的 (输入 token, 缓存命中 token)
+        self.last: tuple[int, int] = (0, 0)
+        self._lock = threading.Lock()
+
+    def record(self, message) -> None:
+        prompt, cached = _usage_counts(message)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt
+            self.cached_tokens += cached
+            self.last = (prompt, cached)
+
+    def stats(self) -> str:
+        with self._lock:
+            if not self.calls:
+                return "无模型调用"
+            ratio = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+            return (
+                f"{self.calls} 次调用, 平均输入 {self.prompt_tokens / self.calls:.0f} tokens"
+                f"（缓存命中 {self.cached_tokens / self.calls:.0f}, "
+                f"未命中 {(self.prompt_tokens - self.cached_tokens) / self.calls:.0f}, 命中率 {ratio:.1%}）"
+            )
+
+
+def _usage_counts(message) -> tuple[int, int]:
+    meta = getattr(message, "usage_metadata", None) or {}
+    prompt = meta.get("input_tokens") or 0
+    cached = (meta.get("input_token_details") or {}).get("cache_read") or 0
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    prompt = prompt or token_usage.get("prompt_tokens") or 0
+    cached = cached or token_usage.get("prompt_cache_hit_tokens") or 0
+    return int(prompt), int(cached)
+
+
+def _to_messages(prompt):
+    """
+    把 build_prompt 的文本拆成两条消息：指令与 Schema 组成的前缀作为 system 消息（同一数据库下逐字节不变，
+    复查/修复 Prompt 也只在末尾追加），示例、记忆与问题作为 human 消息，便于服务端复用前缀缓存。
+    不含 Schema 的 Prompt（如问题重写）原样发送。
+    """
+    if not isinstance(prompt, str):
+        return prompt
+    marker = "数据库Schema:"
+    idx = prompt.find(marker)
+    if idx == -1:
+        return prompt
+    start = idx + len(marker)
+    start += len(prompt[start:]) - len(prompt[start:].lstrip("\n"))
+    end = prompt.find("\n\n", start)
+    if end == -1:
+        return prompt
+    return [SystemMessage(prompt[:end]), HumanMessage(prompt[end:].lstrip("\n"))]
+
+
+# 复查门控：(问题, 草稿SQL) -> 风险说明列表，为空时跳过复查调用
+ReviewGate = Callable[[str, str], list[str]]
+
+
+# 生成流程写成生成器：yield 需要调用模型的 prompt，接收模型输出文本，return 最终结果。
+# 同步/异步接口共用同一套流程，只是驱动方式不同（_run / _arun）。
+_Steps = Generator[str, str, str]
+
+
 class LLMClient:
     def __init__(
         self,
@@ -19,6 +165,10 @@ class LLMClient:
         api_key: str | None,
         base_url: str | None,
         temperature: float = 0.0,
+        cache: LLMResponseCache | None = None,
+        max_concurrency: int = 8,
+        requests_per_second: float | None = None,
+        rate_limit_retries: int = 5,
     ) -> None:
         if api_key:
             os.environ["OPENAI_API_KEY"] = api_key
@@ -26,89 +176,456 @@ class LLMClient:
             os.environ["OPENAI_BASE_URL"] = base_url
         self.model_name = model_name
         self.temperature = temperature
-        self.client = ChatOpenAI(
-            model=model_name,
-            temperature=temperature,
-            base_url=base_url,
-            api_key=api_key,
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.rate_limit_retries = rate_limit_retries
+        self._limiter = _RateLimiter(requests_per_second) if requests_per_second else None
+        # asyncio.Semaphore 绑定事件循环，按循环分别创建
+        self._semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        # 异步调用用的模型实例同样按循环创建，见 _async_client
+        self._async_clients: dict[asyncio.AbstractEventLoop, ChatOpenAI] = {}
+        self.usage = TokenUsage()
+        self.client = self._chat_model()
+
+    def _chat_model(self, http_async_client: httpx.AsyncClient | None = None) -> ChatOpenAI:
+        return ChatOpenAI(
+            model=self.model_name,
+            temperature=self.temperature,
+            base_url=self.base_url,
+            api_key=self.api_key,
+            http_client=_shared_http_client(self.base_url),
+            http_async_client=http_async_client,
+            stream_usage=True,
         )
 
+    def _async_client(self) -> ChatOpenAI:
+        """Chat model bound to an HTTP client of the running event loop."""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            for closed in [l for l in self._async_clients if l.is_closed()]:
+                del self._async_clients[closed]
+            client = self._async_clients[loop] = self._chat_model(
+                _shared_async_http_client(self.base_url)
+            )
+        return client
+
+    def _invoke(self, prompt) -> str:
+        """Single model call with rate limiting and backoff on HTTP 429."""
+        for attempt in range(self.rate_limit_retries + 1):
+            if self._limiter is not None:
+                self._limiter.wait()
+            try:
+                response = self.client.invoke(_to_messages(prompt))
+                self.usage.record(response)
+                return response.content
+            except openai.RateLimitError:
+                if attempt == self.rate_limit_retries:
+                    raise
+                time.sleep(_backoff(attempt))
+
+    async def _ainvoke(self, prompt, client=None) -> str:
+        client = client or self._async_client()
+        for attempt in range(self.rate_limit_retries + 1):
+            if self._limiter is not None:
+                await self._limiter.await_slot()
+            try:
+                async with self._semaphore():
+                    response = await client.ainvoke(_to_messages(prompt))
+                self.usage.record(response)
+                return response.content
+            except openai.RateLimitError:
+                if attempt == self.rate_limit_retries:
+                    raise
+                await asyncio.sleep(_backoff(attempt))
+
+    def _run(self, steps: _Steps) -> str:
+        try:
+            prompt = next(steps)
+            while True:
+                prompt = steps.send(self._invoke(prompt))
+        except StopIteration as stop:
+            return stop.value
+
+    async def _arun(self, steps: _Steps) -> str:
+        try:
+            prompt = next(steps)
+            while True:
+                prompt = steps.send(await self._ainvoke(prompt))
+        except StopIteration as stop:
+            return stop.value
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def _cache_lookup(
+        self, kind: str, prompt: str, semantic: bool
+    ) -> tuple[str | None, str, str | None, str | None]:
+        """
+        Look up the response cache before calling the model.
+        Exact key: (model, temperature, kind, prompt). With semantic=True, also match
+        near-identical questions, but only when the rest of the prompt (schema, few-shot,
+        memory, value hits) is identical and the question's literals/numbers are the same.
+        """
+        key = hash_text(self.model_name, self.temperature, kind, prompt)
+        scope = question = None
+        if semantic:
+            schema = _extract_schema_from_prompt(prompt)
+            question = _extract_question_from_prompt(prompt)
+            if schema and question:
+                # 问题行以外的部分原样进 scope；字面量不同（"2019" vs "2020"）的问题互不命中
+                context = prompt.replace(question, "")
+                scope = hash_text(
+                    self.model_name, self.temperature, kind, context, *_question_literals(question)
+                )
+        return self.cache.get(key, scope, question), key, scope, question
+
+    def _cached(
+        self,
+        kind: str,
+        prompt: str,
+        steps: Callable[[], _Steps],
+        semantic: bool = False,
+        valid: Callable[[str], bool] = bool,
+    ) -> str:
+        """Cache-through call; results rejected by `valid` are returned but not stored."""
+        if self.cache is None:
+            return self._run(steps())
+        hit, key, scope, question = self._cache_lookup(kind, prompt, semantic)
+        if hit is not None:
+            return hit
+        value = self._run(steps())
+        if valid(value):
+            self.cache.put(key, value, scope, question)
+        return value
+
+    async def _acached(
+        self,
+        kind: str,
+        prompt: str,
+        steps: Callable[[], _Steps],
+        semantic: bool = False,
+        valid: Callable[[str], bool] = bool,
+    ) -> str:
+        if self.cache is None:
+            return await self._arun(steps())
+        hit, key, scope, question = self._cache_lookup(kind, prompt, semantic)
+        if hit is not None:
+            return hit
+        value = await self._arun(steps())
+        if valid(value):
+            self.cache.put(key, value, scope, question)
+        return value
+
     def generate_text(self, prompt: str) -> str:
         """
         Free-form generation (used for question rewrite, etc.).
         """
-        response = self.client.invoke(prompt)
-        return _clean_text(response.content)
+        return self._cached("text", prompt, lambda: _text_steps(prompt))
+
+    async def agenerate_text(self, prompt: str) -> str:
+        return await self._acached("text", prompt, lambda: _text_steps(prompt))
 
-    def generate_sql(self, prompt: str) -> str:
+    def generate_sql(self, prompt: str, review_gate: ReviewGate | None = None) -> str:
         """
         Two-pass generation for higher execution accuracy:
         1) Draft SQL from the original prompt
         2) Ask the model to review/fix common mistakes (IDs vs names/titles, JOIN type, Top-1 ties, etc.)
+        With review_gate, pass 2 only runs when the gate reports a risk for the (repaired) draft.
         """
-        sql = ""
-
-        # Pass 1: draft
-        response = self.client.invoke(prompt)
-        sql = _clean_sql(response.content)
-
-        # If draft is not a SELECT, force regenerate a couple times
-        if not sql.lower().startswith("select"):
-            for _ in range(2):
-                response = self.client.invoke(
-                    prompt
-                    + "\n\n请注意：最终只输出一条以 SELECT 开头的 SQL，不要解释。SQL:"
-                )
-                sql = _clean_sql(response.content)
-                if sql.lower().startswith("select"):
-                    break
+        return self._cached(
+            _sql_kind(review_gate), prompt, lambda: _sql_steps(prompt, review_gate),
+            semantic=True, valid=is_query,
+        )
 
-        # Pass 2: review & repair (even if SQL looks ok)
-        if sql.lower().startswith("select"):
-            review_prompt = (
-                prompt
-                + "\n\n下面是一条候选SQL，请检查它是否【严格回答问题】且【符合上述规则】。"
-                + "常见错误：选了ID而不是name/title；不该用LEFT JOIN却用了；“最高/最多”用MAX导致并列不一致；多余GROUP BY；缺少/多了DISTINCT。\n"
-                + f"候选SQL: {sql}\n\n"
-                + "如果候选SQL正确，原样输出；如果不正确，输出修正后的SQL。只输出SQL："
-            )
-            response2 = self.client.invoke(review_prompt)
-            repaired = _clean_sql(response2.content)
-            if repaired.lower().startswith("select"):
-                sql = repaired
+    async def agenerate_sql(self, prompt: str, review_gate: ReviewGate | None = None) -> str:
+        return await self._acached(
+            _sql_kind(review_gate), prompt, lambda: _sql_steps(prompt, review_gate),
+            semantic=True, valid=is_query,
+        )
 
-        # Deterministic repairs to better match exec metric
-        sql = _deterministic_sql_repairs(prompt, sql)
-        return sql
+    async def agenerate_candidates(
+        self,
+        prompt: str,
+        n: int,
+        temperature: float = 0.7,
+        timeout: float | None = None,
+    ) -> list[str]:
+        """
+        Self-consistency drafts: n single-pass generations sent concurrently (no review pass),
+        so wall-clock is about one model round trip. The first candidate uses the client's own
+        temperature, the others are sampled at `temperature`. Candidates still pending after
+        `timeout` seconds are dropped; at least one is always awaited.
+        """
+        key = None
+        if self.cache is not None:
+            key = hash_text(self.model_name, self.temperature, "candidates", n, temperature, prompt)
+            hit = self.cache.get(key)
+            if hit is not None:
+                return json.loads(hit)
+
+        client = self._async_client()
+        sampler = client.bind(temperature=temperature)
+        tasks = [
+            asyncio.create_task(self._ainvoke(prompt, client if i == 0 else sampler))
+            for i in range(n)
+        ]
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if not done:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+
+        candidates: list[str] = []
+        errors: list[BaseException] = []
+        for task in tasks:
+            if task not in done:
+                continue
+            if task.exception() is not None:
+                errors.append(task.exception())
+                continue
+            candidates.append(_deterministic_sql_repairs(prompt, _clean_sql(task.result())))
+        if not candidates:
+            raise errors[0]
+        # 部分超时的结果不缓存，下次仍尝试取满 n 条
+        if key is not None and len(candidates) == n:
+            self.cache.put(key, json.dumps(candidates, ensure_ascii=False))
+        return candidates
+
+    def stream_sql(self, prompt: str) -> "SQLStream":
+        """
+        Streaming single-pass draft for the UI: iterate the returned SQLStream for text chunks
+        (e.g. st.write_stream); the stream stops as soon as one complete statement has arrived,
+        and the cleaned SQL is then available as `.sql`. No review pass - callers validate/EXPLAIN
+        the statement right away and fall back to repair_sql on failure.
+        """
+        return SQLStream(self, prompt)
+
+    def _stream(self, prompt) -> Iterator[str]:
+        if self._limiter is not None:
+            self._limiter.wait()
+        merged = None
+        try:
+            for chunk in self.client.stream(_to_messages(prompt)):
+                merged = chunk if merged is None else merged + chunk
+                if chunk.content:
+                    yield chunk.content
+        finally:
+            # 提前停止读取时服务端不会返回用量，只记录完整读完的调用
+            if merged is not None and merged.usage_metadata:
+                self.usage.record(merged)
+
+    def review_sql(self, prompt: str, sql: str, review_gate: ReviewGate | None = None) -> str:
+        """
+        Pass 2 of generate_sql on an existing draft (e.g. a streamed one).
+        With review_gate, the review call only runs when the gate reports a risk.
+        """
+        return self._cached(
+            "review" if review_gate is None else "review-gated", f"{prompt}\x1f{sql}",
+            lambda: _review_steps(prompt, sql, review_gate), valid=is_query,
+        )
 
     def repair_sql(self, prompt: str, sql: str, error: str) -> str:
         """
         Fix SQL using the DB error message as feedback.
+        Repairs that are not a SELECT or that return the input unchanged are not cached.
         """
-        repair_prompt = (
+        return self._cached(
+            "repair", f"{prompt}\x1f{sql}\x1f{error}", lambda: _repair_steps(prompt, sql, error),
+            valid=lambda fixed: is_query(fixed) and fixed != sql,
+        )
+
+    async def arepair_sql(self, prompt: str, sql: str, error: str) -> str:
+        return await self._acached(
+            "repair", f"{prompt}\x1f{sql}\x1f{error}", lambda: _repair_steps(prompt, sql, error),
+            valid=lambda fixed: is_query(fixed) and fixed != sql,
+        )
+
+
+class SQLStream:
+    """Iterable of streamed text chunks; `.sql` holds the final SQL once iteration finishes."""
+
+    def __init__(self, llm: LLMClient, prompt: str):
+        self.llm = llm
+        self.prompt = prompt
+        self.sql = ""
+        self.cached = False
+
+    def __iter__(self) -> Iterator[str]:
+        llm = self.llm
+        key = None
+        if llm.cache is not None:
+            key = hash_text(llm.model_name, llm.temperature, "stream", self.prompt)
+            hit = llm.cache.get(key)
+            if hit is not None:
+                self.sql, self.cached = hit, True
+                yield hit
+                return
+
+        text = ""
+        chunks = llm._stream(self.prompt)
+        try:
+            for piece in chunks:
+                text += piece
+                end = _statement_end(text)
+                if end is not None:
+                    # 语句已完整，不再等待模型输出后面的解释文字
+                    yield piece[: len(piece) - (len(text) - end)]
+                    text = text[:end]
+                    break
+                yield piece
+        finally:
+            chunks.close()
+        sql = _clean_sql(text)
+        # 去掉语句前的说明文字（"Here's the SQL: ..."）
+        sql = sql[_statement_start(sql) or 0 :]
+        self.sql = _deterministic_sql_repairs(self.prompt, sql.rstrip(";").strip())
+        if key is not None and is_query(self.sql):
+            llm.cache.put(key, self.sql)
+
+
+_STATEMENT_START_RE = re.compile(
+    r"(?i)\bselect\b|\bwith\s+(?:recursive\s+)?[\w\"`]+\s*(?:\([^)]*\)\s*)?as\s*\("
+)
+
+
+def _parses(sql: str) -> bool:
+    try:
+        parse_select(sql)
+    except Exception:
+        return False
+    return True
+
+
+def _statement_start(text: str) -> int | None:
+    """
+    SQL 语句（SELECT 或 WITH ... AS (）在文本中的起始位置，找不到时返回 None。
+    说明文字里也可能出现 "select" 一词，取第一个能解析为查询的位置，都不能解析时取第一个。
+    """
+    starts = [m.start() for m in _STATEMENT_START_RE.finditer(text)]
+    for start in starts:
+        if _parses(text[start:]):
+            return start
+    return starts[0] if starts else None
+
+
+def _semicolon_end(text: str, start: int) -> int | None:
+    quote = None
+    for i in range(start, len(text)):
+        ch = text[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == ";":
+            return i + 1
+    return None
+
+
+def _statement_end(text: str) -> int | None:
+    """
+    流式输出中第一条完整 SQL 语句的结束位置：代码块的结束围栏（代码块前可以有说明文字），或引号外的分号。
+    引号从语句起始处开始跟踪，语句前说明文字里的撇号（"Here's the SQL"）不影响判断；
+    说明文字里的 "select" 一词也可能被当作起始位置，因此只接受截到分号后能解析为查询的语句。
+    """
+    fence = text.find("```")
+    if fence != -1:
+        body = text.find("\n", fence)
+        if body == -1:
+            return None
+        close = text.find("```", body)
+        return None if close == -1 else close + 3
+    for match in _STATEMENT_START_RE.finditer(text):
+        end = _semicolon_end(text, match.start())
+        if end is not None and _parses(text[match.start() : end]):
+            return end
+    return None
+
+
+def _text_steps(prompt: str) -> _Steps:
+    return _clean_text((yield prompt))
+
+
+def _sql_kind(review_gate: ReviewGate | None) -> str:
+    # 门控模式可能跳过复查，结果与两阶段生成分开缓存
+    return "sql" if review_gate is None else "sql-gated"
+
+
+def _sql_steps(prompt: str, review_gate: ReviewGate | None = None) -> _Steps:
+    sql = ""
+
+    # Pass 1: draft
+    sql = _clean_sql((yield prompt))
+
+    # If draft is not a query (SELECT / WITH ...), force regenerate a couple times
+    if not is_query(sql):
+        for _ in range(2):
+            sql = _clean_sql((yield (
+                prompt
+                + "\n\n请注意：最终只输出一条以 SELECT 或 WITH 开头的查询 SQL，不要解释。SQL:"
+            )))
+            if is_query(sql):
+                break
+
+    return (yield from _review_steps(prompt, sql, review_gate))
+
+
+def _review_steps(prompt: str, sql: str, review_gate: ReviewGate | None = None) -> _Steps:
+    # Pass 2: review & repair (even if SQL looks ok; gated mode: only when local checks flag a risk)
+    if is_query(sql) and review_gate is not None:
+        sql = _deterministic_sql_repairs(prompt, sql)
+        if not review_gate(_extract_question_from_prompt(prompt) or "", sql):
+            return sql
+    if is_query(sql):
+        review_prompt = (
             prompt
-            + "\n\n下面这条SQL在执行时发生了错误。请修复它，使其能在 SQLite 上执行，并且仍然回答原问题。"
-            + "只输出修复后的SQL，不要解释。\n"
-            + f"候选SQL: {sql}\n"
-            + f"执行错误: {error}\n"
-            + "修复后的SQL:"
+            + "\n\n下面是一条候选SQL，请检查它是否【严格回答问题】且【符合上述规则】。"
+            + "常见错误：选了ID而不是name/title；不该用LEFT JOIN却用了；“最高/最多”用MAX导致并列不一致；多余GROUP BY；缺少/多了DISTINCT。\n"
+            + f"候选SQL: {sql}\n\n"
+            + "如果候选SQL正确，原样输出；如果不正确，输出修正后的SQL。只输出SQL："
         )
-        response = self.client.invoke(repair_prompt)
-        fixed = _clean_sql(response.content)
-        if fixed.lower().startswith("select"):
-            return _deterministic_sql_repairs(prompt, fixed)
-        return sql
+        repaired = _clean_sql((yield review_prompt))
+        if is_query(repaired):
+            sql = repaired
+
+    # Deterministic repairs to better match exec metric
+    sql = _deterministic_sql_repairs(prompt, sql)
+    return sql
+
+
+def _repair_steps(prompt: str, sql: str, error: str) -> _Steps:
+    repair_prompt = (
+        prompt
+        + "\n\n下面这条SQL在执行时发生了错误。请修复它，使其能在 SQLite 上执行，并且仍然回答原问题。"
+        + "只输出修复后的SQL，不要解释。\n"
+        + f"候选SQL: {sql}\n"
+        + f"执行错误: {error}\n"
+        + "修复后的SQL:"
+    )
+    fixed = _clean_sql((yield repair_prompt))
+    if is_query(fixed):
+        return _deterministic_sql_repairs(prompt, fixed)
+    return sql
 
 
 def _clean_sql(text: str) -> str:
     text = text.strip()
-    if text.startswith("```"):
-        lines = text.splitlines()
-        if len(lines) >= 2:
-            lines = lines[1:]
-        if lines and lines[-1].strip().startswith("```"):
-            lines = lines[:-1]
-        text = "\n".join(lines).strip()
+    fence = text.find("```")
+    if fence != -1:
+        # 只取第一个代码块的内容：代码块前后的说明文字都丢弃，开头一行的语言标记（```sql）也去掉
+        body = text[fence + 3 :]
+        newline = body.find("\n")
+        if newline != -1:
+            body = body[newline + 1 :]
+        close = body.find("```")
+        text = (body if close == -1 else body[:close]).strip()
     if text.lower().startswith("sql"):
         text = text[3:].strip()
     return text.strip()
@@ -139,6 +656,23 @@ def _extract_question_from_prompt(prompt: str) -> str | None:
     return rest.splitlines()[0].strip()
 
 
+_LITERAL_RE = re.compile(r"'[^']*'|\"[^\"]*\"|\d+(?:\.\d+)?|(?<=\s)[A-Z][\w-]*")
+
+
+def _question_literals(question: str) -> list[str]:
+    """问题中的引号字符串、数字和（非句首的）大写词，按出现顺序去重。"""
+    return list(dict.fromkeys(_LITERAL_RE.findall(question)))
+
+
+def _extract_schema_from_prompt(prompt: str) -> str | None:
+    idx = prompt.find("数据库Schema:")
+    if idx == -1:
+        return None
+    rest = prompt[idx + len("数据库Schema:") :].lstrip("\n")
+    end = rest.find("\n\n")
+    return rest if end == -1 else rest[:end]
+
+
 def _question_wants_distinct(question: str) -> bool:
     q = question.lower()
     keywords = [
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+from .config import AppConfig
+
+
+def hash_text(*parts: object) -> str:
+    payload = "\x1f".join(str(p) for p in parts)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    LLM 响应的两级缓存，持久化到本地 SQLite：
+
+    1. 精确缓存：键为 (模型, temperature, 调用类型, prompt) 的哈希；
+    2. 语义缓存（可选，semantic_threshold 为空或 0 时关闭）：在同一 scope 内按问题向量的
+       余弦相似度查找，相似度不低于 semantic_threshold 时视为命中。scope 由调用方给出，
+       应覆盖问题以外的全部 Prompt 内容及问题中的字面量，见 LLMClient._cache_lookup。
+
+    过期条目（超过 ttl 秒）不再返回；条目总数超过 max_entries 时按最近访问时间淘汰。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        encode: Callable[[list[str]], np.ndarray] | None = None,
+        semantic_threshold: float | None = None,
+        ttl: float | None = 7 * 24 * 3600,
+        max_entries: int = 10_000,
+        encoder_name: str = "",
+    ):
+        self.encode = encode
+        # 不同编码器的向量不可比较，语义缓存的 scope 中带上编码器名
+        self.encoder_name = encoder_name
+        self.semantic_threshold = semantic_threshold if encode is not None else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # scope -> (行 id 数组, 归一化向量矩阵)，写入该 scope 时失效
+        self._scope_vectors: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS exact (
+                key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL
+            );
+            CREATE TABLE IF NOT EXISTS semantic (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT, question TEXT,
+                embedding BLOB, value TEXT, created REAL, accessed REAL
+            );
+            CREATE INDEX IF NOT EXISTS semantic_scope ON semantic(scope);
+            """
+        )
+        self._conn.commit()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "exact_hits": self.hits_exact,
+            "semantic_hits": self.hits_semantic,
+            "misses": self.misses,
+        }
+
+    def get(self, key: str, scope: str | None = None, question: str | None = None) -> str | None:
+        with self._lock:
+            value = self._get_exact(key)
+            if value is not None:
+                self.hits_exact += 1
+                return value
+            if scope and question and self.semantic_threshold:
+                value = self._get_semantic(f"{scope}:{self.encoder_name}", question)
+                if value is not None:
+                    self.hits_semantic += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(
+        self, key: str, value: str, scope: str | None = None, question: str | None = None
+    ) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO exact VALUES (?, ?, ?, ?)", (key, value, now, now)
+            )
+            if scope and question and self.semantic_threshold:
+                scope = f"{scope}:{self.encoder_name}"
+                embedding = self._embed(question)
+                self._conn.execute(
+                    "INSERT INTO semantic (scope, question, embedding, value, created, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (scope, question, embedding.tobytes(), value, now, now),
+                )
+                self._scope_vectors.pop(scope, None)
+            self._evict()
+            self._conn.commit()
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _get_exact(self, key: str) -> str | None:
+        row = self._conn.execute(
+            "SELECT value, created FROM exact WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        self._conn.execute("UPDATE exact SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return row[0]
+
+    def _get_semantic(self, scope: str, question: str) -> str | None:
+        vectors = self._scope_vectors.get(scope)
+        if vectors is None:
+            since = time.time() - self.ttl if self.ttl is not None else 0.0
+            rows = self._conn.execute(
+                "SELECT id, embedding FROM semantic WHERE scope = ? AND created >= ?",
+                (scope, since),
+            ).fetchall()
+            if not rows:
+                return None
+            ids = np.array([r[0] for r in rows], dtype=np.int64)
+            matrix = np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows])
+            vectors = self._scope_vectors[scope] = (ids, matrix)
+
+        ids, matrix = vectors
+        sims = matrix @ self._embed(question)
+        best = int(np.argmax(sims))
+        if sims[best] < self.semantic_threshold:
+            return None
+        row = self._conn.execute(
+            "SELECT value, created FROM semantic WHERE id = ?", (int(ids[best]),)
+        ).fetchone()
+        if row is None or self._expired(row[1]):
+            self._scope_vectors.pop(scope, None)
+            return None
+        self._conn.execute(
+            "UPDATE semantic SET accessed = ? WHERE id = ?", (time.time(), int(ids[best]))
+        )
+        self._conn.commit()
+        return row[0]
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.encode([question]), dtype=np.float32)[0]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict(self) -> None:
+        if self.ttl is not None:
+            cutoff = time.time() - self.ttl
+            self._conn.execute("DELETE FROM exact WHERE created < ?", (cutoff,))
+            self._conn.execute("DELETE FROM semantic WHERE created < ?", (cutoff,))
+        for table in ("exact", "semantic"):
+            count = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            if count > self.max_entries:
+                key_col = "key" if table == "exact" else "id"
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE {key_col} IN "
+                    f"(SELECT {key_col} FROM {table} ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                if table == "semantic":
+                    self._scope_vectors.clear()
+
+
+def build_llm_cache(config: AppConfig) -> LLMResponseCache | None:
+    """按配置创建响应缓存；未设置 LLM_CACHE_PATH 时返回 None（不缓存）。"""
+    if not config.llm_cache_path:
+        return None
+    encode = None
+    if config.llm_cache_semantic_threshold > 0:
+        from .encoder import get_encoder
+
+        def encode(texts: list[str]) -> np.ndarray:
+            model = get_encoder(config.encoder_model, config.encoder_backend, config.encoder_onnx_file)
+            return model.encode(texts, show_progress_bar=False)
+
+    return LLMResponseCache(
+        config.llm_cache_path,
+        encode=encode,
+        semantic_threshold=config.llm_cache_semantic_threshold or None,
+        ttl=config.llm_cache_ttl or None,
+        max_entries=config.llm_cache_max_entries,
+        encoder_name=f"{config.encoder_model}@{config.encoder_backend}",
+    )
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+
+from .config import PromptBudgetSpec, SelfConsistencySpec
+from .data_loader import Example
+from .llm import LLMClient, ReviewGate
+from .memory import MemoryTurn
+from .prompt import arewrite_question, build_prompt
+from .retrieval import HybridRetriever
+from .schema_linking import SchemaLinker
+from .self_consistency import agenerate_and_vote
+from .sql_executor import QueryResult
+from .sql_validator import SQLValidator
+from .value_index import ValueIndex
+
+
+@dataclass(frozen=True)
+class PipelineResult:
+    # 实际用于生成 SQL 的问题（多轮对话时可能是重写后的问题）
+    question: str
+    few_shot: list[Example]
+    prompt: str
+    sql: str
+    # 自洽投票模式下胜出候选的执行结果与票数（所有候选都失败时 result 为 None、error 为失败原因）
+    result: QueryResult | None = None
+    error: str | None = None
+    votes: tuple[int, int] | None = None
+
+
+async def agenerate_for_question(
+    llm: LLMClient,
+    retriever: HybridRetriever,
+    schema_text: str,
+    question: str,
+    memory: list[MemoryTurn],
+    top_k: int,
+    speculative: bool = True,
+    linker: SchemaLinker | None = None,
+    value_index: ValueIndex | None = None,
+    self_consistency: SelfConsistencySpec | None = None,
+    db_path: str | None = None,
+    validator: SQLValidator | None = None,
+    generate: bool = True,
+    budget: PromptBudgetSpec | None = None,
+    review_gate: ReviewGate | None = None,
+) -> PipelineResult:
+    """
+    重写 → 检索 → 生成，互不依赖的步骤并发执行：
+    - 问题重写请求在途时，同时对原问题做检索（编码 + FAISS）；
+    - speculative=True 时再用原问题提前起草 SQL，若重写结果与原问题相同则直接采用，
+      否则取消草稿、按重写后的问题重新检索与生成。
+    输出与串行执行（rewrite_question → search → generate_sql）一致。
+    提供 linker 时按最终问题与检索到的示例裁剪 Schema；
+    提供 value_index 时在 Prompt 中附上问题提到的数据库取值。
+    self_consistency 开启（且给出 db_path）时并发生成多条候选，在 db_path 上执行后按结果投票。
+    budget 限制 Prompt 的 token 数（超出时舍弃排名靠后的示例与最早的记忆）。
+    review_gate 为门控复查，只有本地检查发现风险时才发起复查调用。
+    generate=False 时只完成重写、检索与 Prompt 组装（sql 为空），由调用方自行生成（如流式输出）。
+    """
+
+    async def generate(target: str, shots: asyncio.Task) -> PipelineResult:
+        few_shot = await shots
+        schema = schema_text
+        if linker is not None:
+            schema = (await asyncio.to_thread(linker.link, target, few_shot)).text
+        value_hits = value_index.lookup(target) if value_index is not None else None
+        prompt = build_prompt(schema, few_shot, target, memory, value_hits, budget)
+        if not generate:
+            return PipelineResult(question=target, few_shot=few_shot, prompt=prompt, sql="")
+        if self_consistency is not None and self_consistency.enabled and db_path:
+            vote = await agenerate_and_vote(llm, db_path, prompt, self_consistency, validator)
+            return PipelineResult(
+                question=target, few_shot=few_shot, prompt=prompt, sql=vote.sql,
+                result=vote.result, error=vote.error, votes=(vote.votes, len(vote.candidates)),
+            )
+        sql = await llm.agenerate_sql(prompt, review_gate)
+        return PipelineResult(question=target, few_shot=few_shot, prompt=prompt, sql=sql)
+
+    def retrieve(target: str) -> asyncio.Task:
+        return asyncio.create_task(asyncio.to_thread(retriever.search, target, top_k))
+
+    raw_shots = retrieve(question)
+    if not memory:
+        return await generate(question, raw_shots)
+
+    rewrite = asyncio.create_task(arewrite_question(llm, question, memory))
+    draft = asyncio.create_task(generate(question, raw_shots)) if speculative else None
+
+    target = await rewrite
+    if target == question:
+        return await draft if draft is not None else await generate(question, raw_shots)
+
+    if draft is not None:
+        draft.cancel()
+    return await generate(target, retrieve(target))
+
+
+def generate_for_question(
+    llm: LLMClient,
+    retriever: HybridRetriever,
+    schema_text: str,
+    question: str,
+    memory: list[MemoryTurn],
+    top_k: int,
+    speculative: bool = True,
+    linker: SchemaLinker | None = None,
+    value_index: ValueIndex | None = None,
+    self_consistency: SelfConsistencySpec | None = None,
+    db_path: str | None = None,
+    validator: SQLValidator | None = None,
+    generate: bool = True,
+    budget: PromptBudgetSpec | None = None,
+    review_gate: ReviewGate | None = None,
+) -> PipelineResult:
+    """agenerate_for_question 的同步入口（Streamlit 脚本中使用）。"""
+    return asyncio.run(
+        agenerate_for_question(
+            llm, retriever, schema_text, question, memory, top_k, speculative, linker, value_index,
+            self_consistency, db_path, validator, generate, budget, review_gate,
+        )
+    )
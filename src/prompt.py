@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+from .config import PromptBudgetSpec
 from .data_loader import Example
 from .memory import MemoryTurn
 from .llm import LLMClient
+from .tokenizer import estimate_tokens
+from .value_index import ValueHit
 
 REWRITE_INSTRUCTION = (
     "你是一个对话重写助手。你的任务是根据对话历史，将用户最新的、不完整的提问重写为一个完整的、"
@@ -10,15 +13,18 @@ REWRITE_INSTRUCTION = (
     "注意：只需输出重写后的问题，不要有任何解释。"
 )
 
-def rewrite_question(llm: LLMClient, question: str, memory: list[MemoryTurn]) -> str:
-    if not memory:
-        return question
-    
+def _rewrite_prompt(question: str, memory: list[MemoryTurn]) -> str:
     history_text = ""
     for turn in memory:
         history_text += f"问：{turn.question}\n答：(生成了对应的SQL)\n"
     
-    prompt = f"{REWRITE_INSTRUCTION}\n\n对话历史：\n{history_text}\n最新提问：{question}\n\n重写后的完整问题："
+    return f"{REWRITE_INSTRUCTION}\n\n对话历史：\n{history_text}\n最新提问：{question}\n\n重写后的完整问题："
+
+def rewrite_question(llm: LLMClient, question: str, memory: list[MemoryTurn]) -> str:
+    if not memory:
+        return question
+    
+    prompt = _rewrite_prompt(question, memory)
     
     try:
         rewritten = llm.generate_text(prompt)
@@ -26,6 +32,15 @@ def rewrite_question(llm: LLMClient, question: str, memory: list[MemoryTurn]) ->
     except:
         return question
 
+async def arewrite_question(llm: LLMClient, question: str, memory: list[MemoryTurn]) -> str:
+    if not memory:
+        return question
+
+    try:
+        return await llm.agenerate_text(_rewrite_prompt(question, memory))
+    except Exception:
+        return question
+
 SYSTEM_INSTRUCTION = (
     "你是一个顶级的 Text2SQL 专家。你的任务是将自然语言准确转换为 SQLite 兼容的 SQL。"
     "请严格遵守以下规则：\n"
@@ -43,13 +58,76 @@ SYSTEM_INSTRUCTION = (
 )
 
 
+def _take(items: list, budget: float, render) -> list:
+    """按顺序保留片段直到超出预算，之后的（得分更低的）全部舍弃。"""
+    kept = []
+    used = 0
+    for item in items:
+        used += estimate_tokens(render(item))
+        if used > budget:
+            break
+        kept.append(item)
+    return kept
+
+
+def _example_text(ex: Example) -> str:
+    return f"Q: {ex.question}\nSQL: {ex.sql}\n"
+
+
+def _turn_text(turn: MemoryTurn) -> str:
+    return f"Q: {turn.question}\nSQL: {turn.sql}\n"
+
+
+def fit_budget(
+    schema_text: str,
+    examples: list[Example],
+    question: str,
+    memory: list[MemoryTurn] | None,
+    value_hits: list[ValueHit] | None,
+    budget: PromptBudgetSpec,
+) -> tuple[list[Example], list[MemoryTurn]]:
+    """
+    在 budget.total 内挑选 Few-shot 示例与记忆：指令、Schema、取值与问题先计入，
+    剩余部分按份额分给示例与记忆（记忆用不完的份额归示例，示例用不完的归记忆）；
+    示例按检索排名保留，先舍弃排名靠后的；记忆保留最近的轮次，先舍弃最早的。
+    """
+    fixed = estimate_tokens(build_prompt(schema_text, [], question, None, value_hits))
+    available = max(budget.total - fixed, 0)
+    shares = budget.few_shot_share + budget.memory_share
+    memory_header = estimate_tokens("最近对话记忆(仅供参考):\n")
+    # 记忆只预留实际需要的部分（不超过其份额），其余都可给示例
+    memory_need = sum(estimate_tokens(_turn_text(t)) for t in memory or []) + memory_header if memory else 0
+    memory_reserve = min(memory_need, available * budget.memory_share / shares if shares else 0)
+    shot_budget = available - memory_reserve
+    kept_examples = _take(examples, shot_budget - estimate_tokens("示例:\n"), _example_text)
+    used = sum(estimate_tokens(_example_text(ex)) for ex in kept_examples)
+    if kept_examples:
+        used += estimate_tokens("示例:\n")
+    memory_budget = available - used - memory_header
+    kept_turns = _take(list(reversed(memory or [])), memory_budget, _turn_text)[::-1]
+    return kept_examples, kept_turns
+
+
 def build_prompt(
     schema_text: str,
     examples: list[Example],
     question: str,
     memory: list[MemoryTurn] | None = None,
+    value_hits: list[ValueHit] | None = None,
+    budget: PromptBudgetSpec | None = None,
 ) -> str:
+    """
+    前缀在前、可变部分在后：指令与 Schema 之后才是取值命中、示例、记忆与问题。
+    LLMClient 把 Schema 之前的部分作为 system 消息发送，同一数据库下逐字节相同，可命中服务端前缀缓存。
+    提供 budget 时按 fit_budget 裁剪示例与记忆，Prompt 大小有上限。
+    """
+    if budget is not None and budget.enabled:
+        examples, memory = fit_budget(schema_text, examples, question, memory, value_hits, budget)
     parts = [SYSTEM_INSTRUCTION, "", "数据库Schema:", schema_text, ""]
+    if value_hits:
+        parts.append("问题中提到的数据库取值(字面量请按此书写):")
+        parts.extend(hit.to_text() for hit in value_hits)
+        parts.append("")
     if examples:
         parts.append("示例:")
         for ex in examples:
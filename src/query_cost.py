@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Callable
+
+import sqlglot
+from sqlglot import exp
+
+# 超过该行数的全表扫描在原因中单独列出
+_LARGE_SCAN_ROWS = 100_000
+
+# EXPLAIN QUERY PLAN 中的循环节点，兼容 "SCAN TABLE t AS a"（旧版本）与 "SCAN a"（3.36+）
+_LOOP_RE = re.compile(
+    r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\S+)(?:\s+AS\s+(\S+))?(?:\s+USING\s+(.*))?$", re.IGNORECASE
+)
+
+
+@dataclass(frozen=True)
+class PlanEstimate:
+    """执行计划的代价估计；SQLite 为估计的行访问次数，PostgreSQL 为规划器的 Total Cost。"""
+
+    cost: float
+    # 可读的问题说明（全表扫描、无索引的嵌套循环等），用于拒绝时反馈给 LLM
+    reasons: list[str] = field(default_factory=list)
+    plan: list[str] = field(default_factory=list)
+
+    def describe(self, max_cost: float) -> str:
+        lines = [f"查询预估代价 {self.cost:,.0f} 超过上限 {max_cost:,.0f}，已拒绝执行。"]
+        lines.extend(f"- {r}" for r in self.reasons)
+        lines.append("请添加更严格的过滤条件、使用带索引的列做连接，或避免无条件的笛卡尔积。")
+        return "\n".join(lines)
+
+
+def table_aliases(sql: str, dialect: str = "sqlite") -> dict[str, str]:
+    """别名（小写）-> 表名，执行计划中的 SCAN/SEARCH 只给出别名。"""
+    try:
+        tree = sqlglot.parse_one(sql, read=dialect)
+    except Exception:
+        return {}
+    aliases: dict[str, str] = {}
+    for table in tree.find_all(exp.Table):
+        aliases[table.name.lower()] = table.name
+        if table.alias:
+            aliases[table.alias.lower()] = table.name
+    return aliases
+
+
+def _search_rows(rows: int, using: str) -> float:
+    # 没有统计信息时的粗略估计：等值查找近似一次 B-tree 探查，范围查找按四分之一表计
+    if "PRIMARY KEY" in using.upper() and "=" in using and "<" not in using and ">" not in using:
+        return 1.0
+    if "<" in using or ">" in using:
+        return max(rows / 4, 1.0)
+    return math.log2(rows + 1) + 1
+
+
+def sqlite_plan_estimate(
+    conn: sqlite3.Connection, sql: str, table_rows: Callable[[str], int]
+) -> PlanEstimate:
+    """
+    基于 EXPLAIN QUERY PLAN 估计行访问次数：同一层的 SCAN/SEARCH 构成嵌套循环，逐层相乘；
+    子查询按各自的层累加，相关子查询再乘以外层循环次数。
+    """
+    nodes = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    children: dict[int, list[tuple[int, str]]] = {}
+    for node_id, parent, _, detail in nodes:
+        children.setdefault(parent, []).append((node_id, detail))
+    aliases = table_aliases(sql)
+    reasons: list[str] = []
+
+    def group_cost(parent: int) -> float:
+        product = 1.0
+        total = 0.0
+        for node_id, detail in children.get(parent, []):
+            match = _LOOP_RE.match(detail)
+            if match:
+                kind, name, alias, using = match.group(1).upper(), match.group(2), match.group(3), match.group(4) or ""
+                table = aliases.get((alias or name).lower(), name)
+                rows = max(table_rows(table), 1)
+                if "AUTOMATIC" in using.upper():
+                    # 连接列没有索引，SQLite 先对整表建临时索引
+                    total += rows * math.log2(rows + 1)
+                    reasons.append(f"表 {table} 的连接列没有索引，需临时建立自动索引（约 {rows:,} 行）")
+                if kind == "SCAN":
+                    if product > 1:
+                        reasons.append(
+                            f"表 {table} 在嵌套循环内层全表扫描（约 {rows:,} 行 × 外层 {product:,.0f} 次），"
+                            "缺少连接条件或可用索引"
+                        )
+                    elif rows >= _LARGE_SCAN_ROWS:
+                        reasons.append(f"全表扫描 {table}（约 {rows:,} 行）")
+                    loop_rows = float(rows)
+                else:
+                    loop_rows = _search_rows(rows, using)
+                product *= loop_rows
+                total += product
+            elif detail.upper().startswith("CORRELATED"):
+                total += product * group_cost(node_id)
+            else:
+                total += group_cost(node_id)
+        return total
+
+    cost = group_cost(0)
+    return PlanEstimate(cost=cost, reasons=reasons, plan=[n[3] for n in nodes])
+
+
+def sqlite_table_rows(conn: sqlite3.Connection, table: str) -> int:
+    """表行数估计：优先 sqlite_stat1，其次 MAX(rowid)（O(log n)），WITHOUT ROWID 表才退回 COUNT(*)。"""
+    quoted = '"' + table.replace('"', '""') + '"'
+    try:
+        row = conn.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = ? AND stat IS NOT NULL LIMIT 1", (table,)
+        ).fetchone()
+        if row:
+            return int(str(row[0]).split()[0])
+    except sqlite3.Error:
+        pass
+    try:
+        row = conn.execute(f"SELECT MAX(rowid) FROM {quoted}").fetchone()
+        return int(row[0] or 0)
+    except sqlite3.Error:
+        pass
+    try:
+        return int(conn.execute(f"SELECT COUNT(*) FROM {quoted}").fetchone()[0])
+    except sqlite3.Error:
+        return 0
+
+
+def postgres_plan_estimate(plan_json) -> PlanEstimate:
+    """解析 EXPLAIN (FORMAT JSON) 的结果：代价取根节点 Total Cost，并标出大表顺序扫描与无索引的嵌套循环。"""
+    if isinstance(plan_json, str):
+        plan_json = json.loads(plan_json)
+    root = plan_json[0]["Plan"]
+    reasons: list[str] = []
+    lines: list[str] = []
+
+    def walk(node: dict, depth: int) -> None:
+        node_type = node.get("Node Type", "")
+        relation = node.get("Relation Name")
+        rows = node.get("Plan Rows", 0)
+        lines.append("  " * depth + f"{node_type} {relation or ''} (cost={node.get('Total Cost', 0)}, rows={rows})")
+        if node_type == "Seq Scan" and rows >= _LARGE_SCAN_ROWS:
+            reasons.append(f"顺序扫描 {relation}（约 {rows:,} 行）")
+        children = node.get("Plans", [])
+        if node_type == "Nested Loop" and len(children) == 2:
+            inner = children[1]
+            if inner.get("Node Type") in ("Seq Scan", "Materialize") and not node.get("Join Filter"):
+                reasons.append(
+                    f"嵌套循环内层为全表扫描（{inner.get('Relation Name') or inner.get('Node Type')}），"
+                    "缺少连接条件或可用索引"
+                )
+        for child in children:
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return PlanEstimate(cost=float(root.get("Total Cost", 0.0)), reasons=reasons, plan=lines)
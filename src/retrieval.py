@@ -1,84 +1,316 @@
 from __future__ import annotations
 
-import math
 import re
 import numpy as np
-from dataclasses import dataclass
-from typing import Iterable
+from collections import Counter
+from dataclasses import dataclass, replace
+from typing import Iterable, Sequence
 import faiss
+from scipy import sparse
 from sentence_transformers import SentenceTransformer
 
+from .config import FusionSpec, VectorIndexSpec
 from .data_loader import Example
+from .encoder import encoder_cache_name, get_encoder
+from .index_cache import IndexCache
 
 _TOKEN_RE = re.compile(r"[a-zA-Z0-9_]+")
 
 def _tokenize(text: str) -> list[str]:
     return [t.lower() for t in _TOKEN_RE.findall(text)]
 
+
+def _top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """在 (ids, scores) 中取得分最高的 k 个，argpartition 后只对 k 个元素排序。"""
+    if k <= 0 or scores.size == 0:
+        return ids[:0], scores[:0]
+    if scores.size > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(scores.size)
+    order = part[np.argsort(-scores[part], kind="stable")]
+    return ids[order], scores[order]
+
+
+class TfidfIndex:
+    """
+    稀疏 TF-IDF 索引：词表 -> 列号，文档行向量预先 L2 归一化并存为 CSR 矩阵，
+    检索只需一次稀疏矩阵乘法 + argpartition 取 Top-K，支持批量查询。
+
+    max_df < 1 时忽略文档频率高于该比例的词（what/the 等），
+    大语料下可显著减少乘法触及的文档数；默认 1.0 与逐条计算结果一致。
+    """
+
+    def __init__(self, texts: Sequence[str], max_df: float = 1.0):
+        self.vocab: dict[str, int] = {}
+        indptr = [0]
+        indices: list[int] = []
+        data: list[float] = []
+        for text in texts:
+            tokens = _tokenize(text)
+            counts = Counter(tokens)
+            for token, count in counts.items():
+                col = self.vocab.setdefault(token, len(self.vocab))
+                indices.append(col)
+                data.append(count / len(tokens))
+            indptr.append(len(indices))
+
+        n_docs = max(len(texts), 1)
+        col_ids = np.asarray(indices, dtype=np.int32)
+        df = np.bincount(col_ids, minlength=len(self.vocab))
+        self.idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+        if max_df < 1.0:
+            self.idf[df > max_df * n_docs] = 0.0
+
+        values = np.asarray(data, dtype=np.float32) * self.idf[col_ids]
+        matrix = sparse.csr_matrix(
+            (values, col_ids, np.asarray(indptr, dtype=np.int64)),
+            shape=(len(texts), len(self.vocab)),
+        )
+        matrix.eliminate_zeros()
+        # 预先转置为 (词表 x 文档)，查询时 Q @ M^T 为 CSR x CSR 乘法
+        self.matrix_t = _l2_normalize_rows(matrix).T.tocsr()
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        return {
+            "vocab": np.array(list(self.vocab), dtype=str),
+            "idf": self.idf,
+            "data": self.matrix_t.data,
+            "indices": self.matrix_t.indices,
+            "indptr": self.matrix_t.indptr,
+            "shape": np.array(self.matrix_t.shape, dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "TfidfIndex":
+        index = cls.__new__(cls)
+        index.vocab = {t: i for i, t in enumerate(arrays["vocab"].tolist())}
+        index.idf = arrays["idf"]
+        index.matrix_t = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(arrays["shape"]),
+        )
+        return index
+
+    def _vectorize(self, queries: Sequence[str]) -> sparse.csr_matrix:
+        indptr = [0]
+        indices: list[int] = []
+        data: list[float] = []
+        for query in queries:
+            tokens = _tokenize(query)
+            counts = Counter(tokens)
+            for token, count in counts.items():
+                col = self.vocab.get(token)
+                if col is None or self.idf[col] == 0.0:
+                    continue
+                indices.append(col)
+                data.append(count / len(tokens) * self.idf[col])
+            indptr.append(len(indices))
+        matrix = sparse.csr_matrix(
+            (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(queries), len(self.vocab)),
+        )
+        return _l2_normalize_rows(matrix)
+
+    def search_batch(self, queries: Sequence[str], k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        返回每个查询的 (文档下标, 余弦相似度)，按得分降序；只包含得分 > 0 的文档。
+        """
+        if not queries:
+            return []
+        scores = (self._vectorize(queries) @ self.matrix_t).tocsr()
+        results = []
+        for row in range(scores.shape[0]):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            results.append(_top_k(scores.indices[start:end], scores.data[start:end], k))
+        return results
+
+
+def _l2_normalize_rows(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1.0 / norms) @ matrix, dtype=np.float32)
+
+
+def _effective_spec(spec: VectorIndexSpec, n_vectors: int) -> VectorIndexSpec:
+    """
+    按语料规模修正训练参数：IVF 每个聚类至少需要约 39 个训练点，
+    PQ 码本需要至少 2^nbits 个训练点；样本太少时退化为精确的 flat 索引。
+    """
+    if spec.kind not in ("ivf", "ivfpq"):
+        return spec
+    nlist = min(spec.nlist, n_vectors // 39)
+    if nlist < 1 or (spec.kind == "ivfpq" and n_vectors < 2 ** spec.pq_nbits):
+        return replace(spec, kind="flat")
+    return replace(spec, nlist=nlist)
+
+
+def build_vector_index(embeddings: np.ndarray, spec: VectorIndexSpec) -> faiss.Index:
+    """按 spec 构建（并训练）内积索引；输入向量需已做 L2 归一化。"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    dim = embeddings.shape[1]
+    if spec.kind == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif spec.kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, spec.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = spec.ef_construction
+    elif spec.kind == "ivf":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, spec.nlist, faiss.METRIC_INNER_PRODUCT)
+    elif spec.kind == "ivfpq":
+        if dim % spec.pq_m:
+            raise ValueError(f"向量维度 {dim} 不能被 PQ_M={spec.pq_m} 整除。")
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(
+            quantizer, dim, spec.nlist, spec.pq_m, spec.pq_nbits, faiss.METRIC_INNER_PRODUCT
+        )
+    else:
+        raise ValueError(f"未知的向量索引类型: {spec.kind}")
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def _apply_search_params(index: faiss.Index, spec: VectorIndexSpec) -> faiss.Index:
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(spec.nprobe, index.nlist)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = spec.ef_search
+    return index
+
+
 class HybridRetriever:
-    def __init__(self, examples: Iterable[Example], model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        examples: Iterable[Example],
+        model_name: str = "all-MiniLM-L6-v2",
+        tfidf_max_df: float = 1.0,
+        cache_dir: str | None = None,
+        index_spec: VectorIndexSpec | None = None,
+        fusion: FusionSpec | None = None,
+        encoder_backend: str = "torch",
+        onnx_file: str | None = None,
+    ):
         self.examples = list(examples)
-        
-        # 1. TF-IDF 初始化
-        self.df: dict[str, int] = {}
-        tokenized = []
-        for ex in self.examples:
-            tokens = _tokenize(ex.question)
-            tokenized.append(tokens)
-            for token in set(tokens):
-                self.df[token] = self.df.get(token, 0) + 1
-        
-        n_docs = max(len(self.examples), 1)
-        self.idf = {t: math.log((1 + n_docs) / (1 + freq)) + 1 for t, freq in self.df.items()}
-        
-        self.tfidf_vectors = []
-        self.tfidf_norms = []
-        for tokens in tokenized:
-            tf = {}
-            for t in tokens: tf[t] = tf.get(t, 0) + 1
-            vec = {t: (count / len(tokens)) * self.idf.get(t, 0.0) for t, count in tf.items()}
-            norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
-            self.tfidf_vectors.append(vec)
-            self.tfidf_norms.append(norm)
-
-        # 2. Vector 初始化
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        self.index_spec = index_spec or VectorIndexSpec()
+        self.fusion = fusion or FusionSpec()
+        self.encoder_backend = encoder_backend
+        self.onnx_file = onnx_file
+        self._vector_index: faiss.Index | None = None
+
         questions = [ex.question for ex in self.examples]
-        embeddings = self.model.encode(questions, show_progress_bar=False)
+        # cache_dir 为空时不落盘，每次重新编码
+        self.cache = (
+            IndexCache(cache_dir, encoder_cache_name(model_name, encoder_backend), questions)
+            if cache_dir
+            else None
+        )
+
+        # 1. TF-IDF 初始化（稀疏矩阵）
+        if self.cache:
+            arrays = self.cache.load_npz(
+                f"tfidf-{tfidf_max_df:g}",
+                lambda: TfidfIndex(questions, max_df=tfidf_max_df).to_arrays(),
+            )
+            self.tfidf = TfidfIndex.from_arrays(arrays)
+        else:
+            self.tfidf = TfidfIndex(questions, max_df=tfidf_max_df)
+
+        # 2. Vector 初始化：有缓存时直接 mmap，模型与 FAISS 索引在首次检索时才加载
+        if self.cache:
+            self.embeddings = self.cache.load_embeddings(self.encode)
+        else:
+            self.embeddings = self.encode(questions)
+
+    @property
+    def model(self) -> SentenceTransformer:
+        # 进程内共享，首次编码时才加载
+        return get_encoder(self.model_name, self.encoder_backend, self.onnx_file)
+
+    @property
+    def vector_index(self) -> faiss.Index:
+        if self._vector_index is None:
+            spec = _effective_spec(self.index_spec, len(self.examples))
+            build = lambda: build_vector_index(self.embeddings, spec)
+            if self.cache:
+                index = self.cache.load_vector_index(spec.cache_name, build)
+            else:
+                index = build()
+            self._vector_index = _apply_search_params(index, spec)
+        return self._vector_index
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        embeddings = self.model.encode(texts, show_progress_bar=False)
         embeddings = np.array(embeddings).astype("float32")
         faiss.normalize_L2(embeddings)
-        self.vector_index = faiss.IndexFlatIP(embeddings.shape[1])
-        self.vector_index.add(embeddings)
+        return embeddings
 
     def search(self, query: str, k: int = 5) -> list[Example]:
-        if not self.examples: return []
-        
+        return self.search_many([query], k)[0]
+
+    def search_many(self, queries: Sequence[str], k: int = 5) -> list[list[Example]]:
+        """
+        批量检索：所有查询一次 encode 前向 + 一次 FAISS 检索，按查询返回混合结果。
+        """
+        if not self.examples or k <= 0: return [[] for _ in queries]
+        if not queries: return []
+
+        # 两路各取 k*4 个候选，融合后再截断到 k
+        n_candidates = k * 4
+
         # TF-IDF 检索
-        q_tokens = _tokenize(query)
-        q_tf = {}
-        for t in q_tokens: q_tf[t] = q_tf.get(t, 0) + 1
-        q_vec = {t: (count / max(len(q_tokens), 1)) * self.idf.get(t, 0.0) for t, count in q_tf.items()}
-        q_norm = math.sqrt(sum(v * v for v in q_vec.values())) or 1.0
-        
-        tfidf_scores = []
-        for vec, norm in zip(self.tfidf_vectors, self.tfidf_norms):
-            dot = sum(q_vec.get(t, 0.0) * vec.get(t, 0.0) for t in q_vec)
-            tfidf_scores.append(dot / (q_norm * norm))
-        
+        tfidf_hits = self.tfidf.search_batch(queries, n_candidates)
+
         # Vector 检索
-        q_emb = self.model.encode([query], show_progress_bar=False)
-        q_emb = np.array(q_emb).astype("float32")
-        faiss.normalize_L2(q_emb)
-        _, v_indices = self.vector_index.search(q_emb, k * 2)
-        
+        q_emb = self.encode(list(queries))
+        v_scores, v_indices = self.vector_index.search(q_emb, n_candidates)
+
         # 合并结果 (Hybrid)
-        top_tfidf_idx = np.argsort(tfidf_scores)[::-1][:k*2]
-        combined_idx = list(top_tfidf_idx) + list(v_indices[0])
-        
         results = []
-        seen = set()
-        for idx in combined_idx:
-            if idx != -1 and idx < len(self.examples) and idx not in seen:
-                results.append(self.examples[idx])
-                seen.add(idx)
-        return results[:k]
+        for (t_ids, t_scores), v_ids, v_row in zip(tfidf_hits, v_indices, v_scores):
+            valid = v_ids != -1
+            ids, _ = fuse_scores(
+                (t_ids, t_scores), (v_ids[valid], v_row[valid]), self.fusion, k
+            )
+            results.append([self.examples[i] for i in ids])
+        return results
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    if scores.size == 0:
+        return scores
+    low, high = scores.min(), scores.max()
+    if high - low < 1e-9:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+def fuse_scores(
+    lexical: tuple[np.ndarray, np.ndarray],
+    semantic: tuple[np.ndarray, np.ndarray],
+    fusion: FusionSpec,
+    k: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    融合两路 (文档下标, 得分) 结果（各自按得分降序），返回融合后 Top-K 的 (下标, 融合得分)。
+    """
+    (l_ids, l_scores), (s_ids, s_scores) = lexical, semantic
+    weights = (1.0 - fusion.semantic_weight, fusion.semantic_weight)
+    if fusion.method == "rrf":
+        l_contrib = weights[0] / (fusion.rrf_k + 1 + np.arange(l_ids.size))
+        s_contrib = weights[1] / (fusion.rrf_k + 1 + np.arange(s_ids.size))
+    elif fusion.method == "weighted":
+        l_contrib = weights[0] * _min_max(l_scores.astype(np.float64))
+        s_contrib = weights[1] * _min_max(s_scores.astype(np.float64))
+    else:
+        raise ValueError(f"未知的融合方式: {fusion.method}")
+
+    ids = np.concatenate([l_ids, s_ids]).astype(np.int64)
+    contrib = np.concatenate([l_contrib, s_contrib])
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    fused = np.bincount(inverse, weights=contrib, minlength=unique_ids.size)
+    return _top_k(unique_ids, fused, k)
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import re
+import threading
+from collections import Counter
+
+import sqlglot
+from sqlglot import exp
+
+from .sql_executor import get_executor
+from .sql_validator import SQLValidator
+
+# 问题中出现这些词时 LEFT JOIN 是合理的（需要保留没有匹配的行）。
+# "all"/"any"/"no"/"所有" 在普通问题里太常见（"list all courses"），不作为触发词
+_LEFT_JOIN_TRIGGERS = (
+    "including", "include", "even", "without", "none", "zero",
+    "即使", "没有", "包括", "包含", "为0", "为 0",
+)
+_ID_WORD_RE = re.compile(r"(?i)\bids?\b|编号|identifier")
+
+
+def _is_id_column(name: str) -> bool:
+    lowered = name.lower()
+    return lowered == "id" or lowered.endswith("_id")
+
+
+class RiskGate:
+    """
+    门控复查：草稿 SQL 先经过本地检查，只有发现风险时才发起 LLM 复查调用。
+
+    检查项：静态校验（SQLValidator）、EXPLAIN 能否成功及代价是否超限，以及复查 Prompt 针对的常见错误——
+    问题没提编号却返回 ID 列、问题没有相应措辞却用了 LEFT JOIN、用 MAX/MIN 子查询求 Top-1。
+    实例可直接作为 LLMClient.generate_sql 的 review_gate，并统计放行/复查次数及各类原因。
+    """
+
+    def __init__(self, db_path: str, validator: SQLValidator | None = None, dialect: str = "sqlite"):
+        self.db_path = db_path
+        self.validator = validator
+        self.dialect = dialect
+        self.checked = 0
+        self.escalated = 0
+        self.reasons: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, question: str, sql: str) -> list[str]:
+        risks = self.risks(question, sql)
+        with self._lock:
+            self.checked += 1
+            if risks:
+                self.escalated += 1
+                self.reasons.update(r.split(":", 1)[0] for r in risks)
+        return risks
+
+    def risks(self, question: str, sql: str) -> list[str]:
+        if self.validator is not None:
+            issues = self.validator.validate(sql)
+            if issues:
+                return [f"validation: {i.message}" for i in issues]
+        try:
+            tree = sqlglot.parse_one(sql, read=self.dialect)
+        except Exception as e:
+            return [f"parse: {e}"]
+
+        risks: list[str] = []
+        executor = get_executor()
+        try:
+            estimate = executor.estimate_cost(self.db_path, sql)
+            if executor.max_cost and estimate.cost > executor.max_cost:
+                risks.append(f"cost: 预估代价 {estimate.cost:,.0f} 超过上限")
+        except Exception as e:
+            risks.append(f"explain: {e}")
+
+        lowered_question = f" {question.lower()} "
+        if isinstance(tree, exp.Select) and not _ID_WORD_RE.search(question):
+            for projection in tree.selects:
+                column = projection.unalias()
+                if isinstance(column, exp.Column) and _is_id_column(column.name):
+                    risks.append(f"id_column: 问题未要求编号，却返回了 {column.name}")
+        for join in tree.find_all(exp.Join):
+            if join.side.upper() == "LEFT" and not any(t in lowered_question for t in _LEFT_JOIN_TRIGGERS):
+                risks.append("left_join: 问题没有要求保留无匹配的行，却使用了 LEFT JOIN")
+                break
+        for subquery in tree.find_all(exp.Subquery):
+            # 只看 "= (SELECT MAX(...))" 形式的 Top-1；"> (SELECT MAX(...))" 之类的比较是正常用法
+            select = subquery.this
+            if isinstance(subquery.parent, exp.EQ) and isinstance(select, exp.Select) and any(
+                isinstance(s.unalias(), (exp.Max, exp.Min)) for s in select.selects
+            ):
+                risks.append("max_subquery: 使用 MAX/MIN 子查询求最值，并列时可能与 ORDER BY ... LIMIT 1 不一致")
+                break
+        return risks
+
+    def stats(self) -> str:
+        with self._lock:
+            if not self.checked:
+                return "无草稿"
+            reasons = ", ".join(f"{k} {v}" for k, v in self.reasons.most_common())
+            return (
+                f"复查 {self.escalated}/{self.checked} ({self.escalated / self.checked:.1%})"
+                + (f"，原因: {reasons}" if reasons else "")
+            )
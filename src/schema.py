@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import os
 import sqlite3
+from dataclasses import asdict, dataclass, field
 
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect, text
 
 
 def get_schema_from_sqlite(db_path: str) -> str:
@@ -29,43 +32,258 @@ def get_schema_from_sqlite(db_path: str) -> str:
         conn.close()
 
 
-def get_schema(db_path: str) -> str:
-    db_url = os.getenv("DB_URL")
-    if not db_url:
-        # SQLite 增强版：带示例数据
-        conn = sqlite3.connect(db_path)
+# 每列展示的示例值个数
+_SAMPLES_PER_COLUMN = 3
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    name: str
+    type: str
+    samples: list[str] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class ForeignKey:
+    column: str
+    ref_table: str
+    ref_column: str
+
+
+@dataclass(frozen=True)
+class TableInfo:
+    name: str
+    columns: list[ColumnInfo]
+    foreign_keys: list[ForeignKey]
+    # 表定义的哈希（SQLite 为 sqlite_master.sql，PostgreSQL 为列定义），变化时重新采集该表
+    fingerprint: str
+
+    def to_text(self, with_samples: bool = True, sample_columns: set[str] | None = None) -> str:
+        # sample_columns 不为 None 时只给其中的列附示例值
+        col_defs = []
+        for col in self.columns:
+            show = with_samples and (sample_columns is None or col.name in sample_columns)
+            sample_str = f" (示例: {', '.join(col.samples)})" if show and col.samples else ""
+            col_defs.append(f"{col.name} {col.type}{sample_str}")
+        return f"Table {self.name}: " + ", ".join(col_defs)
+
+    @staticmethod
+    def from_dict(data: dict) -> "TableInfo":
+        return TableInfo(
+            name=data["name"],
+            columns=[ColumnInfo(**c) for c in data["columns"]],
+            foreign_keys=[ForeignKey(**fk) for fk in data["foreign_keys"]],
+            fingerprint=data["fingerprint"],
+        )
+
+
+def _hash(text_value: str) -> str:
+    return hashlib.sha1(text_value.encode("utf-8")).hexdigest()
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _first_distinct(rows: list[tuple], num_cols: int) -> list[list[str]]:
+    # 单次扫描同时收集每列前几个不同的非空值
+    samples: list[list[str]] = [[] for _ in range(num_cols)]
+    seen: list[set] = [set() for _ in range(num_cols)]
+    pending = num_cols
+    for row in rows:
+        for j, value in enumerate(row):
+            if value is None or len(samples[j]) >= _SAMPLES_PER_COLUMN or value in seen[j]:
+                continue
+            seen[j].add(value)
+            samples[j].append(str(value))
+            if len(samples[j]) == _SAMPLES_PER_COLUMN:
+                pending -= 1
+        if not pending:
+            break
+    return samples
+
+
+class SchemaCatalog:
+    """
+    数据库结构目录：表、列、外键与示例值。
+
+    每张表只执行一次批量采样（SELECT 所有列 LIMIT sample_rows），从中取各列前几个不同的非空值，
+    代替逐列 SELECT DISTINCT。结果按数据库持久化到 cache_dir，下次加载时只对定义变化的表重新采集。
+    """
+
+    def __init__(self, tables: dict[str, TableInfo]):
+        self.tables = tables
+
+    @property
+    def fingerprint(self) -> str:
+        return _hash("\n".join(f"{name}:{t.fingerprint}" for name, t in sorted(self.tables.items())))
+
+    def to_text(self, tables: list[str] | None = None, with_samples: bool = True) -> str:
+        names = sorted(self.tables) if tables is None else [t for t in sorted(self.tables) if t in tables]
+        return "\n".join(self.tables[name].to_text(with_samples) for name in names)
+
+    @classmethod
+    def load(
+        cls,
+        db_path: str,
+        cache_dir: str | None = None,
+        sample_rows: int = 1000,
+        db_url: str | None = None,
+    ) -> "SchemaCatalog":
+        db_url = db_url if db_url is not None else os.getenv("DB_URL")
+        source = _PostgresSource(db_url, sample_rows) if db_url else _SqliteSource(db_path, sample_rows)
         try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-            tables = [row[0] for row in cursor.fetchall()]
-            lines: list[str] = []
-            for table in tables:
-                if table.startswith("sqlite_"): continue
-                cursor.execute(f"PRAGMA table_info('{table}')")
-                cols = cursor.fetchall()
-                col_defs = []
-                for _, name, col_type, _, _, _ in cols:
-                    # 抓取示例数据
-                    try:
-                        cursor.execute(f"SELECT DISTINCT {name} FROM {table} WHERE {name} IS NOT NULL LIMIT 3")
-                        samples = [str(r[0]) for r in cursor.fetchall()]
-                        sample_str = f" (示例: {', '.join(samples)})" if samples else ""
-                    except:
-                        sample_str = ""
-                    col_defs.append(f"{name} {col_type}{sample_str}")
-                lines.append(f"Table {table}: " + ", ".join(col_defs))
-            return "\n".join(lines)
+            fingerprints = source.table_fingerprints()
+            cache_path = None
+            cached: dict[str, TableInfo] = {}
+            if cache_dir:
+                cache_path = os.path.join(cache_dir, f"schema-{_hash(source.identity)[:16]}.json")
+                cached = _read_cache(cache_path, sample_rows)
+
+            tables: dict[str, TableInfo] = {}
+            changed = False
+            for name, fingerprint in fingerprints.items():
+                table = cached.get(name)
+                if table is None or table.fingerprint != fingerprint:
+                    table = source.describe(name, fingerprint)
+                    changed = True
+                tables[name] = table
+            catalog = cls(tables)
+            if cache_path and (changed or set(cached) != set(tables)):
+                _write_cache(cache_path, sample_rows, catalog)
+            return catalog
         finally:
-            conn.close()
-    
-    # PostgreSQL 保持原样
-    engine = create_engine(db_url)
-    inspector = inspect(engine)
-    lines: list[str] = []
-    for table in sorted(inspector.get_table_names()):
-        cols = inspector.get_columns(table)
-        col_defs = []
-        for col in cols:
-            col_defs.append(f"{col['name']} {col['type']}")
-        lines.append(f"Table {table}: " + ", ".join(col_defs))
-    return "\n".join(lines)
+            source.close()
+
+
+def _read_cache(path: str, sample_rows: int) -> dict[str, TableInfo]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("sample_rows") != sample_rows:
+        return {}
+    return {t["name"]: TableInfo.from_dict(t) for t in data["tables"]}
+
+
+def _write_cache(path: str, sample_rows: int, catalog: SchemaCatalog) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = {
+        "sample_rows": sample_rows,
+        "fingerprint": catalog.fingerprint,
+        "tables": [asdict(catalog.tables[name]) for name in sorted(catalog.tables)],
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class _SqliteSource:
+    def __init__(self, db_path: str, sample_rows: int):
+        self.identity = os.path.abspath(db_path)
+        self.sample_rows = sample_rows
+        self.conn = sqlite3.connect(db_path)
+
+    def table_fingerprints(self) -> dict[str, str]:
+        rows = self.conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type='table' ORDER BY name"
+        ).fetchall()
+        return {name: _hash(sql or "") for name, sql in rows if not name.startswith("sqlite_")}
+
+    def describe(self, table: str, fingerprint: str) -> TableInfo:
+        cols = self.conn.execute(f"PRAGMA table_info({_quote(table)})").fetchall()
+        names = [c[1] for c in cols]
+        try:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(_quote(n) for n in names)} FROM {_quote(table)} LIMIT ?",
+                (self.sample_rows,),
+            ).fetchall()
+            samples = _first_distinct(rows, len(names))
+        except sqlite3.Error:
+            samples = [[] for _ in names]
+        foreign_keys = [
+            ForeignKey(column=fk[3], ref_table=fk[2], ref_column=fk[4] or "")
+            for fk in self.conn.execute(f"PRAGMA foreign_key_list({_quote(table)})").fetchall()
+        ]
+        return TableInfo(
+            name=table,
+            columns=[ColumnInfo(name=c[1], type=c[2], samples=s) for c, s in zip(cols, samples)],
+            foreign_keys=foreign_keys,
+            fingerprint=fingerprint,
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class _PostgresSource:
+    def __init__(self, db_url: str, sample_rows: int):
+        from .sql_executor import get_executor
+
+        self.identity = db_url
+        self.sample_rows = sample_rows
+        self.engine = get_executor().engine(db_url)
+        self.inspector = inspect(self.engine)
+
+    def table_fingerprints(self) -> dict[str, str]:
+        # 一次查询取得所有表的列定义，按表计算哈希
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT table_name, column_name, data_type, ordinal_position "
+                    "FROM information_schema.columns WHERE table_schema = current_schema() "
+                    "ORDER BY table_name, ordinal_position"
+                )
+            ).fetchall()
+        defs: dict[str, list[str]] = {}
+        for table, column, data_type, position in rows:
+            defs.setdefault(table, []).append(f"{position}:{column}:{data_type}")
+        return {table: _hash("\n".join(d)) for table, d in sorted(defs.items())}
+
+    def describe(self, table: str, fingerprint: str) -> TableInfo:
+        cols = self.inspector.get_columns(table)
+        names = [c["name"] for c in cols]
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(
+                    text(
+                        f"SELECT {', '.join(_quote(n) for n in names)} FROM {_quote(table)} "
+                        f"LIMIT {int(self.sample_rows)}"
+                    )
+                ).fetchall()
+            samples = _first_distinct([tuple(r) for r in rows], len(names))
+        except Exception:
+            samples = [[] for _ in names]
+        foreign_keys = [
+            ForeignKey(column=col, ref_table=fk["referred_table"], ref_column=ref)
+            for fk in self.inspector.get_foreign_keys(table)
+            for col, ref in zip(fk["constrained_columns"], fk["referred_columns"])
+        ]
+        return TableInfo(
+            name=table,
+            columns=[
+                ColumnInfo(name=c["name"], type=str(c["type"]), samples=s)
+                for c, s in zip(cols, samples)
+            ],
+            foreign_keys=foreign_keys,
+            fingerprint=fingerprint,
+        )
+
+    def close(self) -> None:
+        pass
+
+
+def load_catalog(db_path: str, cache_dir: str | None = None, sample_rows: int = 1000) -> SchemaCatalog:
+    return SchemaCatalog.load(db_path, cache_dir=cache_dir, sample_rows=sample_rows)
+
+
+def get_schema(db_path: str, cache_dir: str | None = None, sample_rows: int = 1000) -> str:
+    """
+    Schema 文本（每表一行：Table t: col type (示例: ...)），由 SchemaCatalog 生成；
+    PostgreSQL 现在同样带示例值。
+    """
+    return load_catalog(db_path, cache_dir, sample_rows).to_text()
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from .data_loader import Example
+from .schema import SchemaCatalog
+from .tokenizer import estimate_tokens
+
+_WORD_RE = re.compile(r"[A-Za-z]+|[0-9]+")
+
+
+def _split_words(text: str) -> list[str]:
+    # course_id / prereqId / "International Finance" -> course, id, prereq, id, international, finance
+    spaced = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    return [w.lower() for w in _WORD_RE.findall(spaced)]
+
+
+def _stem(word: str) -> str:
+    # 只做最粗略的复数还原，足以让 students/student、courses/course 对上
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _terms(text: str) -> set[str]:
+    return {_stem(w) for w in _split_words(text)}
+
+
+def _overlap(name_terms: set[str], question_terms: set[str]) -> float:
+    # 名称中出现在问题里的词所占比例（id 等通用词不计）
+    terms = name_terms - {"id"}
+    if not terms:
+        return 0.0
+    return len(terms & question_terms) / len(terms)
+
+
+@dataclass(frozen=True)
+class LinkedSchema:
+    text: str
+    tables: list[str]
+    # 裁剪后与完整 Schema 的估计 token 数
+    tokens: int
+    full_tokens: int
+
+
+class SchemaLinker:
+    """
+    按问题裁剪 Schema（schema linking）：
+
+    1. 打分：表名/列名与问题的词重叠、示例值在问题中出现、Few-shot SQL 中引用该表的比例，
+       以及（提供 encode 时）问题与表/列描述的向量相似度；
+    2. 选表：得分不低于最高分 relative_threshold 倍的表，再按外键补齐连接所需的表
+       （连接两张已选表的中间表，以及已选表外键指向的表）；
+    3. 预算：超出 token_budget 时先去掉未命中列的示例值，再按得分从低到高舍弃表（至少保留一张）。
+    """
+
+    def __init__(
+        self,
+        catalog: SchemaCatalog,
+        encode: Callable[[list[str]], np.ndarray] | None = None,
+        token_budget: int | None = None,
+        relative_threshold: float = 0.5,
+        semantic_weight: float = 0.5,
+        with_samples: bool = True,
+    ):
+        self.catalog = catalog
+        # 使用取值索引时 Schema 不带示例值
+        self.with_samples = with_samples
+        self.encode = encode
+        self.token_budget = token_budget
+        self.relative_threshold = relative_threshold
+        self.semantic_weight = semantic_weight
+        self.full_text = catalog.to_text(with_samples=with_samples)
+        self.full_tokens = estimate_tokens(self.full_text)
+
+        self._table_names = sorted(catalog.tables)
+        self._table_terms = {name: _terms(name) for name in self._table_names}
+        self._column_terms = {
+            name: {col.name: _terms(col.name) for col in catalog.tables[name].columns}
+            for name in self._table_names
+        }
+        self._sample_terms = {
+            name: {col.name: _terms(" ".join(col.samples)) for col in catalog.tables[name].columns}
+            for name in self._table_names
+        }
+        # 表/列描述向量首次使用时编码一次
+        self._embeddings: tuple[np.ndarray, list[tuple[str, str | None]]] | None = None
+
+    def _description_embeddings(self) -> tuple[np.ndarray, list[tuple[str, str | None]]]:
+        if self._embeddings is None:
+            texts: list[str] = []
+            owners: list[tuple[str, str | None]] = []
+            for name in self._table_names:
+                table = self.catalog.tables[name]
+                texts.append(f"{name}: " + ", ".join(c.name for c in table.columns))
+                owners.append((name, None))
+                for col in table.columns:
+                    texts.append(f"{name} {col.name}: " + ", ".join(col.samples))
+                    owners.append((name, col.name))
+            self._embeddings = (np.asarray(self.encode(texts), dtype=np.float32), owners)
+        return self._embeddings
+
+    def score(
+        self, question: str, few_shot: list[Example] | None = None
+    ) -> tuple[dict[str, float], dict[str, set[str]]]:
+        """返回 (表得分, 每张表命中的列)。"""
+        q_terms = _terms(question)
+        scores: dict[str, float] = {}
+        linked: dict[str, set[str]] = {}
+        for name in self._table_names:
+            best = _overlap(self._table_terms[name], q_terms)
+            hits: set[str] = set()
+            for col, terms in self._column_terms[name].items():
+                col_score = _overlap(terms, q_terms)
+                if self._sample_terms[name][col] & q_terms - {"id"}:
+                    col_score = max(col_score, 0.5)
+                if col_score > 0:
+                    hits.add(col)
+                best = max(best, col_score)
+            scores[name] = best
+            linked[name] = hits
+
+        if few_shot:
+            mentions: Counter[str] = Counter()
+            lowered = {name: name.lower() for name in self._table_names}
+            for ex in few_shot:
+                sql_words = set(re.findall(r"[a-z0-9_]+", ex.sql.lower()))
+                mentions.update(name for name, low in lowered.items() if low in sql_words)
+            for name, count in mentions.items():
+                scores[name] += 0.5 * count / len(few_shot)
+
+        if self.encode is not None and self.semantic_weight > 0:
+            matrix, owners = self._description_embeddings()
+            query = np.asarray(self.encode([question]), dtype=np.float32)[0]
+            sims = matrix @ query
+            best_sim: dict[str, float] = {}
+            for (name, col), sim in zip(owners, sims.tolist()):
+                best_sim[name] = max(best_sim.get(name, -1.0), sim)
+            for name, sim in best_sim.items():
+                scores[name] += self.semantic_weight * max(sim, 0.0)
+        return scores, linked
+
+    def _fk_closure(self, selected: list[str]) -> list[str]:
+        chosen = set(selected)
+        bridges: list[str] = []
+        parents: list[str] = []
+        for name in self._table_names:
+            if name in chosen:
+                continue
+            refs = {fk.ref_table for fk in self.catalog.tables[name].foreign_keys}
+            if len(refs & chosen) >= 2:
+                bridges.append(name)
+        for name in selected:
+            for fk in self.catalog.tables[name].foreign_keys:
+                ref = fk.ref_table
+                if ref in self.catalog.tables and ref not in chosen and ref not in bridges and ref not in parents:
+                    parents.append(ref)
+        return bridges + parents
+
+    def link(self, question: str, few_shot: list[Example] | None = None) -> LinkedSchema:
+        scores, linked = self.score(question, few_shot)
+        ranked = sorted(self._table_names, key=lambda n: -scores[n])
+        top = scores[ranked[0]] if ranked else 0.0
+        if top <= 0:
+            # 问题与任何表都对不上时不裁剪
+            return LinkedSchema(self.full_text, list(self._table_names), self.full_tokens, self.full_tokens)
+
+        selected = [n for n in ranked if scores[n] >= top * self.relative_threshold]
+        order = selected + self._fk_closure(selected)
+
+        def render(names: list[str], compact: bool) -> str:
+            keep = set(names)
+            return "\n".join(
+                self.catalog.tables[n].to_text(
+                    self.with_samples, sample_columns=linked[n] if compact else None
+                )
+                for n in self._table_names
+                if n in keep
+            )
+
+        text = render(order, compact=False)
+        tokens = estimate_tokens(text)
+        if self.token_budget and tokens > self.token_budget:
+            if self.with_samples:
+                text = render(order, compact=True)
+                tokens = estimate_tokens(text)
+            while tokens > self.token_budget and len(order) > 1:
+                # 连接补齐的表排在已选表之后，优先舍弃；已选表中先舍弃得分低的
+                order = order[:-1]
+                text = render(order, compact=True)
+                tokens = estimate_tokens(text)
+        tables = [n for n in self._table_names if n in set(order)]
+        return LinkedSchema(text, tables, tokens, self.full_tokens)
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+
+from .compare import canonicalize
+from .config import SelfConsistencySpec
+from .llm import LLMClient
+from .sql_executor import QueryResult, execute_sql, normalize_sql
+from .sql_validator import SQLValidator, format_issues
+
+
+@dataclass(frozen=True)
+class Candidate:
+    sql: str
+    result: QueryResult | None = None
+    # 结果集的规范化摘要（忽略行序与列序），结果相同的候选摘要相同
+    digest: str | None = None
+    error: str | None = None
+
+
+@dataclass(frozen=True)
+class Vote:
+    sql: str
+    # 胜出候选的执行结果；所有候选都失败时为 None，error 为第一条候选的错误
+    result: QueryResult | None
+    error: str | None
+    # 与胜出结果相同的候选数 / 参与投票的候选数
+    votes: int
+    candidates: list[Candidate]
+
+
+async def aexecute_candidates(
+    db_path: str,
+    sqls: list[str],
+    validator: SQLValidator | None = None,
+    timeout: float | None = None,
+) -> list[Candidate]:
+    """
+    并行执行候选 SQL（各自在线程池中使用执行器的只读连接），文本相同的候选只执行一次。
+    未通过静态检查或执行出错的候选记为 error，不参与投票。
+    """
+
+    def run(sql: str) -> Candidate:
+        if validator is not None:
+            issues = validator.validate(sql)
+            if issues:
+                return Candidate(sql, error=format_issues(issues))
+        try:
+            result = execute_sql(db_path, sql, timeout=timeout)
+        except Exception as e:
+            return Candidate(sql, error=str(e))
+        return Candidate(sql, result=result, digest=canonicalize(result.rows).digest)
+
+    unique: dict[str, str] = {}
+    for sql in sqls:
+        unique.setdefault(normalize_sql(sql), sql)
+    executed = await asyncio.gather(*(asyncio.to_thread(run, sql) for sql in unique.values()))
+    by_key = dict(zip(unique, executed))
+    return [by_key[normalize_sql(sql)] for sql in sqls]
+
+
+def vote(candidates: list[Candidate]) -> Vote:
+    """按结果集多数投票；票数相同时取最先出现的结果（第一条候选为默认温度生成）。"""
+    groups: dict[str, list[int]] = {}
+    for i, cand in enumerate(candidates):
+        if cand.digest is not None:
+            groups.setdefault(cand.digest, []).append(i)
+    if not groups:
+        first = candidates[0]
+        return Vote(first.sql, None, first.error, 0, candidates)
+    members = max(groups.values(), key=lambda idx: (len(idx), -idx[0]))
+    winner = candidates[members[0]]
+    return Vote(winner.sql, winner.result, None, len(members), candidates)
+
+
+async def agenerate_and_vote(
+    llm: LLMClient,
+    db_path: str,
+    prompt: str,
+    spec: SelfConsistencySpec,
+    validator: SQLValidator | None = None,
+) -> Vote:
+    """并发生成 spec.candidates 条候选 → 并行执行 → 结果集多数投票。"""
+    sqls = await llm.agenerate_candidates(prompt, spec.candidates, spec.temperature, spec.timeout)
+    return vote(await aexecute_candidates(db_path, sqls, validator))
@@ -1,10 +1,39 @@
 from __future__ import annotations
 
+import hashlib
+import pickle
+import re
 import sqlite3
 import os
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
 
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+
+from .config import ExecutorSpec, load_config
+from .query_cost import PlanEstimate, postgres_plan_estimate, sqlite_plan_estimate, sqlite_table_rows
+from .sql_validator import prepare_sql
+
+# SQLite 进度回调的调用间隔（虚拟机指令数）
+_PROGRESS_INTERVAL = 10_000
+
+
+class QueryTimeoutError(RuntimeError):
+    """查询超出执行时间或 VM 步数预算被中止；错误信息可直接回传给 repair_sql。"""
+
+
+class QueryCostError(RuntimeError):
+    """执行计划的预估代价超过上限，查询未被执行；错误信息包含原因，可直接回传给 repair_sql。"""
+
+    def __init__(self, estimate: PlanEstimate, max_cost: float):
+        self.estimate = estimate
+        super().__init__(estimate.describe(max_cost))
 
 
 @dataclass(frozen=True)
@@ -12,52 +41,545 @@ class QueryResult:
     columns: list[str]
     rows: list[tuple]
     row_count: int
+    # 超出行数/字节预算时为 True，rows 只包含预算内的部分
+    truncated: bool = False
+
+    def to_arrow(self):
+        """转为列式的 pyarrow.Table（列名可重复；类型混杂的列退化为字符串）。需要可选依赖 pyarrow。"""
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise ImportError(
+                "QueryResult.to_arrow() 需要 pyarrow，请执行 pip install pyarrow"
+                "（或 pip install -r requirements-optional.txt）"
+            ) from e
+
+        arrays = []
+        for i in range(len(self.columns)):
+            values = [row[i] for row in self.rows]
+            try:
+                arrays.append(pa.array(values))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                arrays.append(pa.array([None if v is None else str(v) for v in values]))
+        return pa.Table.from_arrays(arrays, names=list(self.columns))
+
+
+@dataclass(frozen=True)
+class RowBatch:
+    columns: list[str]
+    rows: list[tuple]
+    # 最后一批因预算耗尽被截断
+    truncated: bool = False
+
+
+class _FetchBudget:
+    """取数阶段强制执行的行数/字节预算（字节数按值的近似大小估算）。"""
+
+    def __init__(self, max_rows: int | None, max_bytes: int | None):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows = 0
+        self.bytes = 0
+
+    def take(self, rows: list[tuple]) -> tuple[list[tuple], bool]:
+        kept = []
+        for row in rows:
+            if self.max_rows is not None and self.rows >= self.max_rows:
+                return kept, True
+            size = _row_nbytes(row)
+            if self.max_bytes is not None and self.bytes + size > self.max_bytes:
+                return kept, True
+            kept.append(row)
+            self.rows += 1
+            self.bytes += size
+        return kept, False
+
+
+def _row_nbytes(row: tuple) -> int:
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        else:
+            size += 8
+    return size
 
 
-def execute_sql(db_path: str, sql: str, max_rows: int = 200) -> QueryResult:
-    cleaned = _sanitize_sql(sql)
-    if cleaned is None:
-        raise ValueError("只允许执行单条SELECT语句。")
+# 各连接当前安装的进度回调（sqlite3 没有读取接口），守卫结束一次调用后据此恢复原来的回调
+_PROGRESS_HANDLERS: dict[int, Callable[[], int]] = {}
 
-    final_sql = _ensure_limit(cleaned, max_rows)
+
+class _SqliteGuard:
+    """
+    通过 set_progress_handler 为 SQLite 查询施加墙钟时间与 VM 步数预算，
+    超限时让 SQLite 中止当前语句（等价于 interrupt）。
+
+    回调只在 call() 包裹的 execute/fetchmany 期间安装，时间也只累计这些调用内部的耗时：
+    流式取数时生成器挂起（调用方处理上一批）不计入超时，同一连接上的其他查询也不受影响。
+    """
+
+    def __init__(self, conn: sqlite3.Connection, timeout: float | None, max_steps: int | None):
+        self.conn = conn
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.elapsed = 0.0
+        self.steps = 0
+        self.reason: str | None = None
+        self._started: float | None = None
+
+    def call(self, fn: Callable, *args):
+        if not self.timeout and not self.max_steps:
+            return fn(*args)
+        key = id(self.conn)
+        previous = _PROGRESS_HANDLERS.get(key)
+        _PROGRESS_HANDLERS[key] = self._check
+        self.conn.set_progress_handler(self._check, _PROGRESS_INTERVAL)
+        self._started = time.monotonic()
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            if self.reason:
+                raise _timeout_error(self.reason) from e
+            raise
+        finally:
+            self.elapsed += time.monotonic() - self._started
+            self._started = None
+            if previous is None:
+                _PROGRESS_HANDLERS.pop(key, None)
+                self.conn.set_progress_handler(None, 0)
+            else:
+                _PROGRESS_HANDLERS[key] = previous
+                self.conn.set_progress_handler(previous, _PROGRESS_INTERVAL)
+
+    def _check(self) -> int:
+        self.steps += _PROGRESS_INTERVAL
+        running = time.monotonic() - self._started if self._started is not None else 0.0
+        if self.timeout and self.elapsed + running > self.timeout:
+            self.reason = f"执行时间超过 {self.timeout:g}s"
+            return 1
+        if self.max_steps and self.steps > self.max_steps:
+            self.reason = f"执行步数超过 {self.max_steps} 步"
+            return 1
+        return 0
+
+
+def _timeout_error(reason: str) -> QueryTimeoutError:
+    return QueryTimeoutError(
+        f"查询超时：{reason}，已被中止。请检查是否缺少 JOIN 条件导致笛卡尔积，或缩小查询范围。"
+    )
+
+
+_SQL_LITERAL_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """折叠空白并小写化，字符串字面量与带引号的标识符保持原样。"""
+    parts = _SQL_LITERAL_RE.split(sql.strip().rstrip(";"))
+    for i in range(0, len(parts), 2):
+        parts[i] = _SPACE_RE.sub(" ", parts[i].lower())
+    return "".join(parts).strip()
+
+
+def db_fingerprint(db_path: str) -> str | None:
+    """
+    数据库指纹：SQLite 为文件路径 + mtime + 大小，文件变化即失效；
+    使用 DB_URL 时需通过 DB_VERSION 显式提供版本号，否则返回 None（不缓存）。
+    """
     db_url = os.getenv("DB_URL")
     if db_url:
-        engine = create_engine(db_url)
-        with engine.connect() as conn:
-            result = conn.execute(text(final_sql))
-            rows = result.fetchall()
-            columns = list(result.keys())
-            return QueryResult(columns=columns, rows=rows, row_count=len(rows))
-    else:
-        conn = sqlite3.connect(db_path)
-        try:
-            cursor = conn.cursor()
-            cursor.execute(final_sql)
-            rows = cursor.fetchall()
-            columns = (
-                [d[0] for d in cursor.description] if cursor.description else []
+        version = os.getenv("DB_VERSION")
+        return f"{db_url}@{version}" if version else None
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return f"{os.path.abspath(db_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class ResultCache:
+    """
+    执行结果缓存：键为 (归一化 SQL, 数据库指纹, 预算参数与代价上限)，
+    内存层按条目数与字节数做 LRU 淘汰，可选 SQLite 文件作为磁盘层。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 64 * 1024 * 1024,
+        disk_path: str | None = None,
+        max_disk_entries: int = 10_000,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[QueryResult, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk: sqlite3.Connection | None = None
+        self._disk_puts = 0
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value BLOB, accessed REAL)"
             )
-            return QueryResult(columns=columns, rows=rows, row_count=len(rows))
-        finally:
+            self._disk.commit()
+
+    @staticmethod
+    def make_key(fingerprint: str, sql: str, *params) -> str:
+        payload = "\x1f".join([fingerprint, normalize_sql(sql), *map(str, params)])
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> QueryResult | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            result = self._disk_get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._put_memory(key, result)
+            return result
+
+    def put(self, key: str, result: QueryResult) -> None:
+        with self._lock:
+            self._put_memory(key, result)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                    (key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), time.time()),
+                )
+                self._disk_puts += 1
+                if self._disk_puts % 100 == 0:
+                    self._disk.execute(
+                        "DELETE FROM results WHERE key NOT IN "
+                        "(SELECT key FROM results ORDER BY accessed DESC LIMIT ?)",
+                        (self.max_disk_entries,),
+                    )
+                self._disk.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM results")
+                self._disk.commit()
+
+    def _put_memory(self, key: str, result: QueryResult) -> None:
+        size = sum(_row_nbytes(row) for row in result.rows) + 64
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (result, size)
+        self._bytes += size
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+
+    def _disk_get(self, key: str) -> QueryResult | None:
+        if self._disk is None:
+            return None
+        row = self._disk.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._disk.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._disk.commit()
+        return pickle.loads(row[0])
+
+
+def _postgres_estimate(conn, sql: str) -> PlanEstimate:
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    return postgres_plan_estimate(plan)
+
+
+# SQLAlchemy 方言名 -> sqlglot 方言名
+_SQLGLOT_DIALECTS = {"postgresql": "postgres", "mssql": "tsql"}
+
+
+def _iter_chunks(
+    fetchmany: Callable[[int], list],
+    columns: list[str],
+    chunk_size: int,
+    budget: _FetchBudget,
+) -> Iterator[RowBatch]:
+    emitted = False
+    while True:
+        rows = fetchmany(chunk_size)
+        if not rows:
+            break
+        kept, exhausted = budget.take([tuple(r) for r in rows])
+        yield RowBatch(columns=columns, rows=kept, truncated=exhausted)
+        emitted = True
+        if exhausted:
+            return
+    if not emitted:
+        # 空结果也返回一批，调用方据此拿到列名
+        yield RowBatch(columns=columns, rows=[])
+
+
+class SQLExecutor:
+    """
+    复用连接的 SQL 执行器：
+    - 设置 DB_URL 时，每个 URL 只创建一个 SQLAlchemy Engine（连接池大小、pre-ping 可配置）；
+    - SQLite 按 (线程, 文件) 缓存只读连接（mode=ro URI），连接只在创建它的线程内使用。
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_pre_ping: bool = True,
+        chunk_size: int = 500,
+        max_bytes: int | None = None,
+        timeout: float | None = None,
+        max_vm_steps: int | None = None,
+        cache: ResultCache | None = None,
+        max_cost: float | None = None,
+    ):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_pre_ping = pool_pre_ping
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_vm_steps = max_vm_steps
+        self.max_cost = max_cost
+        # (数据库指纹, 表名) -> 行数估计，供 SQLite 执行计划估算代价
+        self._table_rows: dict[tuple[str, str], int] = {}
+        self.cache = cache
+        self._engines: dict[str, Engine] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_spec(cls, spec: ExecutorSpec) -> "SQLExecutor":
+        cache = None
+        if spec.cache_entries:
+            cache = ResultCache(
+                max_entries=spec.cache_entries, max_bytes=spec.cache_bytes, disk_path=spec.cache_path
+            )
+        return cls(
+            pool_size=spec.pool_size,
+            max_overflow=spec.max_overflow,
+            pool_pre_ping=spec.pool_pre_ping,
+            chunk_size=spec.chunk_size,
+            max_bytes=spec.max_bytes,
+            timeout=spec.timeout,
+            max_vm_steps=spec.max_vm_steps,
+            max_cost=spec.max_cost,
+            cache=cache,
+        )
+
+    def engine(self, db_url: str) -> Engine:
+        engine = self._engines.get(db_url)
+        if engine is not None:
+            return engine
+        with self._lock:
+            engine = self._engines.get(db_url)
+            if engine is None:
+                kwargs = {"pool_pre_ping": self.pool_pre_ping}
+                if not db_url.startswith("sqlite"):
+                    kwargs.update(pool_size=self.pool_size, max_overflow=self.max_overflow)
+                engine = create_engine(db_url, **kwargs)
+                self._engines[db_url] = engine
+        return engine
+
+    def sqlite_connection(self, db_path: str) -> sqlite3.Connection:
+        connections: dict[str, sqlite3.Connection] | None = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = os.path.abspath(db_path)
+        conn = connections.get(key)
+        if conn is None:
+            uri = Path(key).as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True)
+            connections[key] = conn
+        return conn
+
+    def execute(
+        self,
+        db_path: str,
+        sql: str,
+        max_rows: int = 200,
+        max_bytes: int | None = None,
+        timeout: float | None = None,
+        use_cache: bool = True,
+        max_cost: float | None = None,
+    ) -> QueryResult:
+        key = None
+        fingerprint = db_fingerprint(db_path) if self.cache is not None and use_cache else None
+        if fingerprint is not None:
+            # 代价上限也进缓存键：宽松上限下缓存的结果不能绕过之后更严格的代价检查
+            effective_cost = max_cost if max_cost is not None else self.max_cost
+            key = ResultCache.make_key(fingerprint, sql, max_rows, max_bytes, effective_cost or 0)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        columns: list[str] = []
+        rows: list[tuple] = []
+        truncated = False
+        for batch in self.iter_batches(
+            db_path, sql, max_rows=max_rows, max_bytes=max_bytes, timeout=timeout, max_cost=max_cost
+        ):
+            columns = batch.columns
+            rows.extend(batch.rows)
+            truncated = truncated or batch.truncated
+        result = QueryResult(columns=columns, rows=rows, row_count=len(rows), truncated=truncated)
+        if key is not None:
+            self.cache.put(key, result)
+        return result
+
+    def iter_batches(
+        self,
+        db_path: str,
+        sql: str,
+        max_rows: int | None = None,
+        max_bytes: int | None = None,
+        chunk_size: int | None = None,
+        timeout: float | None = None,
+        max_cost: float | None = None,
+    ) -> Iterator[RowBatch]:
+        """
+        流式执行：按 fetchmany 分批返回结果，取数时强制行数/字节预算，
+        超出预算即停止读取并在最后一批标记 truncated。
+        执行超过 timeout 秒（SQLite 另有 VM 步数上限）时抛出 QueryTimeoutError；
+        执行前 EXPLAIN 的预估代价超过 max_cost（None 取执行器默认值，0 不检查）时抛出 QueryCostError。
+        """
+        db_url = os.getenv("DB_URL")
+        engine = self.engine(db_url) if db_url else None
+        dialect = _SQLGLOT_DIALECTS.get(engine.dialect.name, engine.dialect.name) if engine else "sqlite"
+        # AST 层面的只读检查；多取一行用于判断是否被截断，SQL 自带更大的 LIMIT 时收紧到该值
+        final_sql = prepare_sql(sql, max_rows + 1 if max_rows is not None else None, dialect)
+        budget = _FetchBudget(max_rows, max_bytes if max_bytes is not None else self.max_bytes)
+        chunk_size = chunk_size or self.chunk_size
+        timeout = timeout if timeout is not None else self.timeout
+        max_cost = max_cost if max_cost is not None else self.max_cost
+        if engine is not None:
+            with engine.connect() as conn:
+                if timeout and engine.dialect.name == "postgresql":
+                    conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+                if max_cost and engine.dialect.name == "postgresql":
+                    estimate = _postgres_estimate(conn, final_sql)
+                    if estimate.cost > max_cost:
+                        raise QueryCostError(estimate, max_cost)
+                try:
+                    result = conn.execution_options(stream_results=True).execute(text(final_sql))
+                    columns = list(result.keys())
+                    yield from _iter_chunks(result.fetchmany, columns, chunk_size, budget)
+                except DBAPIError as e:
+                    # 57014 = query_canceled（statement_timeout 触发）
+                    if getattr(e.orig, "pgcode", None) == "57014":
+                        raise _timeout_error(f"执行时间超过 {timeout:g}s") from e
+                    raise
+        else:
+            conn = self.sqlite_connection(db_path)
+            if max_cost:
+                estimate = self._sqlite_estimate(conn, db_path, final_sql)
+                if estimate.cost > max_cost:
+                    raise QueryCostError(estimate, max_cost)
+            cursor = conn.cursor()
+            try:
+                guard = _SqliteGuard(conn, timeout, self.max_vm_steps)
+                guard.call(cursor.execute, final_sql)
+                columns = [d[0] for d in cursor.description] if cursor.description else []
+                yield from _iter_chunks(
+                    lambda size: guard.call(cursor.fetchmany, size), columns, chunk_size, budget
+                )
+            finally:
+                cursor.close()
+
+    def estimate_cost(self, db_path: str, sql: str, max_rows: int | None = 200) -> PlanEstimate:
+        """只做 EXPLAIN，返回与执行时相同口径的代价估计（不执行查询）。"""
+        db_url = os.getenv("DB_URL")
+        engine = self.engine(db_url) if db_url else None
+        dialect = _SQLGLOT_DIALECTS.get(engine.dialect.name, engine.dialect.name) if engine else "sqlite"
+        final_sql = prepare_sql(sql, max_rows + 1 if max_rows is not None else None, dialect)
+        if engine is None:
+            return self._sqlite_estimate(self.sqlite_connection(db_path), db_path, final_sql)
+        if engine.dialect.name != "postgresql":
+            return PlanEstimate(cost=0.0)
+        with engine.connect() as conn:
+            return _postgres_estimate(conn, final_sql)
+
+    def _sqlite_estimate(self, conn: sqlite3.Connection, db_path: str, sql: str) -> PlanEstimate:
+        fingerprint = db_fingerprint(db_path) or os.path.abspath(db_path)
+
+        def table_rows(table: str) -> int:
+            key = (fingerprint, table.lower())
+            rows = self._table_rows.get(key)
+            if rows is None:
+                rows = self._table_rows[key] = sqlite_table_rows(conn, table)
+            return rows
+
+        return sqlite_plan_estimate(conn, sql, table_rows)
+
+    def close(self) -> None:
+        """释放所有 Engine 连接池及当前线程的 SQLite 连接。"""
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+        for conn in getattr(self._local, "connections", {}).values():
             conn.close()
+        self._local.connections = {}
 
 
-def _sanitize_sql(sql: str) -> str | None:
-    cleaned = sql.strip().rstrip(";")
-    if not cleaned:
-        return None
-    lowered = cleaned.lower()
-    if not lowered.startswith("select"):
-        return None
-    if ";" in cleaned:
-        return None
-    return cleaned
+# 进程内共享的执行器，首次使用时按 load_config().executor 创建
+_EXECUTOR: SQLExecutor | None = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor() -> SQLExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = SQLExecutor.from_spec(load_config().executor)
+    return _EXECUTOR
+
+
+def configure_executor(spec: ExecutorSpec) -> SQLExecutor:
+    """按 spec 替换共享执行器（评测命令行参数或测试覆盖配置时使用），旧执行器的连接随之释放。"""
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        previous, _EXECUTOR = _EXECUTOR, SQLExecutor.from_spec(spec)
+    if previous is not None:
+        previous.close()
+    return _EXECUTOR
+
+
+def execute_sql(
+    db_path: str,
+    sql: str,
+    max_rows: int = 200,
+    max_bytes: int | None = None,
+    timeout: float | None = None,
+    max_cost: float | None = None,
+) -> QueryResult:
+    return get_executor().execute(db_path, sql, max_rows, max_bytes, timeout, max_cost=max_cost)
 
 
-def _ensure_limit(sql: str, max_rows: int) -> str:
-    import re
-    lowered = sql.lower()
-    # 使用正则表达式单词边界匹配，无论前面是空格、换行还是制表符都能识别
-    if re.search(r"\blimit\b", lowered):
-        return sql
-    return f"{sql} LIMIT {max_rows}"
+def iter_sql(
+    db_path: str,
+    sql: str,
+    max_rows: int | None = None,
+    max_bytes: int | None = None,
+    chunk_size: int | None = None,
+    timeout: float | None = None,
+    max_cost: float | None = None,
+) -> Iterator[RowBatch]:
+    return get_executor().iter_batches(db_path, sql, max_rows, max_bytes, chunk_size, timeout, max_cost)
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from sqlglot.optimizer.scope import Scope, traverse_scope
+
+from .schema import SchemaCatalog
+
+# 出现在 AST 任意位置都视为写操作/非只读的节点
+_WRITE_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter,
+    exp.Command, exp.Pragma, exp.Set, exp.Transaction, exp.Commit, exp.Rollback,
+)
+
+
+@dataclass(frozen=True)
+class ValidationIssue:
+    # parse_error / not_select / write_statement / multiple_statements /
+    # unknown_table / unknown_alias / unknown_column / ambiguous_column /
+    # aggregate_in_where / nested_aggregate
+    code: str
+    message: str
+    # 出错的对象，如 "student.nme"
+    target: str | None = None
+
+
+class SQLValidationError(ValueError):
+    """SQL 未通过静态检查；issues 为结构化的错误列表，str() 可直接交给 repair_sql。"""
+
+    def __init__(self, issues: list[ValidationIssue]):
+        self.issues = issues
+        super().__init__(format_issues(issues))
+
+
+def format_issues(issues: list[ValidationIssue]) -> str:
+    return "SQL 静态检查未通过:\n" + "\n".join(f"- [{i.code}] {i.message}" for i in issues)
+
+
+def is_query(sql: str) -> bool:
+    """粗略判断模型输出是否为查询语句（以 SELECT 或 WITH 开头），不做解析；完整检查用 parse_select。"""
+    return sql.strip().lower().startswith(("select", "with"))
+
+
+def parse_select(sql: str, dialect: str = "sqlite") -> exp.Query:
+    """解析为单条只读查询（SELECT / UNION / WITH ... SELECT），否则抛出 SQLValidationError。"""
+    cleaned = sql.strip().rstrip(";").strip()
+    if not cleaned:
+        raise SQLValidationError([ValidationIssue("not_select", "SQL 为空")])
+    try:
+        statements = [s for s in sqlglot.parse(cleaned, read=dialect) if s is not None]
+    except ParseError as e:
+        raise SQLValidationError([ValidationIssue("parse_error", f"SQL 无法解析: {e}")]) from e
+    if len(statements) != 1:
+        raise SQLValidationError(
+            [ValidationIssue("multiple_statements", "只允许执行单条SELECT语句。")]
+        )
+    tree = statements[0]
+    if not isinstance(tree, exp.Query):
+        raise SQLValidationError([ValidationIssue("not_select", "只允许执行单条SELECT语句。")])
+    for node in tree.find_all(*_WRITE_NODES):
+        raise SQLValidationError(
+            [ValidationIssue("write_statement", f"查询中包含写操作: {node.key.upper()}")]
+        )
+    return tree
+
+
+def enforce_limit(tree: exp.Query, max_rows: int) -> exp.Query:
+    """
+    在最外层查询上保证 LIMIT 不超过 max_rows：没有 LIMIT 时追加，字面量更大时收紧。
+    子查询及字符串字面量中的 LIMIT 不受影响。
+    """
+    limit = tree.args.get("limit")
+    if limit is None:
+        return tree.limit(max_rows, copy=False)
+    value = limit.expression
+    if isinstance(value, exp.Literal) and not value.is_string:
+        try:
+            if int(value.this) > max_rows:
+                limit.set("expression", exp.Literal.number(max_rows))
+        except ValueError:
+            pass
+    return tree
+
+
+def prepare_sql(sql: str, max_rows: int | None = None, dialect: str = "sqlite") -> str:
+    """只读检查 + LIMIT 注入，返回实际执行的 SQL。"""
+    tree = parse_select(sql, dialect)
+    if max_rows is None:
+        return sql.strip().rstrip(";").strip()
+    return enforce_limit(tree, max_rows).sql(dialect=dialect)
+
+
+class SQLValidator:
+    """
+    对照 SchemaCatalog 做执行前的静态检查：表、别名、列是否存在，未限定的列是否有歧义，
+    聚合函数是否出现在 WHERE 中或嵌套使用。不连接数据库，单条 SQL 通常在毫秒以内完成。
+    """
+
+    def __init__(self, catalog: SchemaCatalog, dialect: str = "sqlite"):
+        self.dialect = dialect
+        # rowid 等 SQLite 隐含列任何表都可引用
+        self._columns = {
+            name.lower(): {c.name.lower() for c in table.columns} | {"rowid", "oid", "_rowid_"}
+            for name, table in catalog.tables.items()
+        }
+
+    def validate(self, sql: str) -> list[ValidationIssue]:
+        try:
+            tree = parse_select(sql, self.dialect)
+        except SQLValidationError as e:
+            return e.issues
+
+        issues: list[ValidationIssue] = []
+        try:
+            scopes = traverse_scope(tree)
+        except Exception:
+            # 作用域分析失败（罕见语法）时只保留解析层面的检查
+            scopes = []
+        for scope in scopes:
+            issues.extend(self._check_scope(scope))
+        issues.extend(self._check_aggregates(tree))
+
+        unique: list[ValidationIssue] = []
+        for issue in issues:
+            if issue not in unique:
+                unique.append(issue)
+        return unique
+
+    def _source_columns(self, source) -> set[str] | None:
+        """来源可提供的列名；None 表示无法确定（SELECT * 的派生表等），不做列检查。"""
+        if isinstance(source, exp.Table):
+            return self._columns.get(source.name.lower())
+        if isinstance(source, Scope):
+            names = source.expression.named_selects
+            if "*" in names:
+                return None
+            return {n.lower() for n in names}
+        return None
+
+    def _resolves(self, scope: Scope, name: str) -> bool:
+        """未限定的列能否在 scope 或其外层（相关子查询）中找到。"""
+        current = scope
+        while current is not None:
+            for source in current.sources.values():
+                cols = self._source_columns(source)
+                if cols is None or name in cols:
+                    return True
+            if name in _select_aliases(current):
+                return True
+            current = current.parent
+        return False
+
+    def _check_scope(self, scope: Scope) -> list[ValidationIssue]:
+        issues: list[ValidationIssue] = []
+        for alias, source in scope.sources.items():
+            if isinstance(source, exp.Table) and source.name.lower() not in self._columns:
+                issues.append(
+                    ValidationIssue("unknown_table", f"表 {source.name} 不存在", source.name)
+                )
+
+        select_aliases = _select_aliases(scope)
+        for column in scope.columns:
+            # scope.columns 会带上子查询中可能相关的列，只检查直接属于本层 SELECT 的列
+            if column.find_ancestor(exp.Select) is not scope.expression:
+                continue
+            name = column.name.lower()
+            qualifier = column.table
+            if qualifier:
+                source = _lookup_source(scope, qualifier)
+                if source is None:
+                    issues.append(
+                        ValidationIssue(
+                            "unknown_alias",
+                            f"{qualifier}.{column.name} 中的表/别名 {qualifier} 未在 FROM/JOIN 中出现",
+                            f"{qualifier}.{column.name}",
+                        )
+                    )
+                    continue
+                cols = self._source_columns(source)
+                if cols is not None and name not in cols:
+                    table_name = source.name if isinstance(source, exp.Table) else qualifier
+                    issues.append(
+                        ValidationIssue(
+                            "unknown_column",
+                            f"表 {table_name} 中没有列 {column.name}",
+                            f"{qualifier}.{column.name}",
+                        )
+                    )
+                continue
+
+            owners = []
+            unknown_source = False
+            for alias, source in scope.sources.items():
+                cols = self._source_columns(source)
+                if cols is None:
+                    unknown_source = True
+                elif name in cols:
+                    owners.append(alias)
+            if len(owners) > 1:
+                issues.append(
+                    ValidationIssue(
+                        "ambiguous_column",
+                        f"列 {column.name} 同时存在于 {', '.join(owners)}，需要加表名/别名限定",
+                        column.name,
+                    )
+                )
+            elif not owners and not unknown_source and name not in select_aliases:
+                # SQLite 中找不到同名列的双引号标识符会被当作字符串字面量
+                if column.this.quoted and self.dialect == "sqlite":
+                    continue
+                if scope.parent is not None and self._resolves(scope.parent, name):
+                    continue
+                issues.append(
+                    ValidationIssue("unknown_column", f"列 {column.name} 不存在", column.name)
+                )
+        return issues
+
+    def _check_aggregates(self, tree: exp.Expression) -> list[ValidationIssue]:
+        issues: list[ValidationIssue] = []
+        for where in tree.find_all(exp.Where):
+            for agg in where.find_all(exp.AggFunc):
+                # WHERE 中子查询里的聚合是合法的
+                if agg.find_ancestor(exp.Select) is where.find_ancestor(exp.Select):
+                    issues.append(
+                        ValidationIssue(
+                            "aggregate_in_where",
+                            f"WHERE 中不能直接使用聚合函数 {agg.sql(dialect=self.dialect)}，请改用 HAVING 或子查询",
+                            agg.sql(dialect=self.dialect),
+                        )
+                    )
+        for agg in tree.find_all(exp.AggFunc):
+            inner = agg.find_ancestor(exp.AggFunc, exp.Select)
+            if isinstance(inner, exp.AggFunc):
+                issues.append(
+                    ValidationIssue(
+                        "nested_aggregate",
+                        f"聚合函数不能嵌套: {inner.sql(dialect=self.dialect)}",
+                        inner.sql(dialect=self.dialect),
+                    )
+                )
+        return issues
+
+
+def _select_aliases(scope: Scope) -> set[str]:
+    # 只算显式别名（SELECT ... AS n），ORDER BY/HAVING 可以引用
+    return {e.alias.lower() for e in scope.expression.selects if isinstance(e, exp.Alias)}
+
+
+def _lookup_source(scope: Scope, qualifier: str):
+    # SQLite 的表名/别名不区分大小写；相关子查询可引用外层的别名
+    current = scope
+    while current is not None:
+        for alias, source in current.sources.items():
+            if alias.lower() == qualifier.lower():
+                return source
+        current = current.parent
+    return None
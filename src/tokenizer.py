@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # 可选依赖，未安装时使用字符数估计
+    tiktoken = None
+
+# tiktoken 编码名，设为空字符串则始终用字符数估计
+_ENCODING_NAME = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None or not _ENCODING_NAME:
+        return None
+    try:
+        return tiktoken.get_encoding(_ENCODING_NAME)
+    except Exception:
+        # 编码文件需联网下载，离线时退回估计
+        return None
+
+
+def tokenizer_name() -> str:
+    return f"tiktoken:{_ENCODING_NAME}" if _encoding() is not None else "heuristic"
+
+
+def _heuristic_tokens(text: str) -> int:
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """
+    token 数：安装了 tiktoken 时用本地分词器计数，否则粗略估计
+    （ASCII 字符约 4 个一个 token，中文等非 ASCII 字符按每字一个 token 计）。
+    结果按文本缓存，Schema、示例等重复出现的片段只分词一次。
+    只用于预算与统计，不追求与具体模型的分词器完全一致。
+    """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return _heuristic_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
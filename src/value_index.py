@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from .config import load_config
+from .sql_executor import db_fingerprint
+
+# 每列最多索引的不同取值个数，以及单个取值的最大长度（更长的多为自由文本，不适合做字面量）
+_MAX_VALUES_PER_COLUMN = 5000
+_MAX_VALUE_LENGTH = 80
+# 问题中参与匹配的最长连续词数
+_MAX_SPAN_WORDS = 5
+# 缓存文件格式版本；v2 起保存原样取值（含首尾空格），旧缓存中是 strip 后的取值
+_CACHE_VERSION = 2
+
+_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "at", "to", "for", "by", "with", "from", "and", "or",
+    "is", "are", "was", "were", "be", "been", "has", "have", "had", "do", "does", "did",
+    "what", "which", "who", "whom", "whose", "where", "when", "how", "many", "much",
+    "find", "give", "show", "list", "return", "tell", "me", "all", "each", "every",
+    "that", "this", "these", "those", "their", "its", "his", "her", "them", "than", "as",
+    "name", "names", "number", "count", "total", "average", "there", "any", "not", "no",
+}
+_WORD_RE = re.compile(r"[^\s,;:?!()\"]+")
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def _normalize(text: str) -> str:
+    # 忽略大小写与标点："Comp. Sci." 与 "comp sci" 视为相同
+    return " ".join(_PUNCT_RE.sub(" ", text.lower()).split())
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass(frozen=True)
+class ValueHit:
+    table: str
+    column: str
+    value: str
+    # 问题中与该值匹配的片段及相似度（1.0 为忽略大小写后完全相同）
+    span: str
+    score: float
+
+    def to_text(self) -> str:
+        escaped = self.value.replace("'", "''")
+        return f"{self.table}.{self.column} = '{escaped}'"
+
+
+class ValueIndex:
+    """
+    数据库文本取值的倒排索引：对每列不同的文本取值建立字符三元组（trigram）倒排表，
+    问题中的连续词片段按 trigram Jaccard 相似度查找相近的取值，返回 (表, 列, 值)。
+    匹配基于归一化后的文本，返回的值是库中的原样取值。
+
+    索引按数据库指纹保存为 npz，数据库文件变化后自动重建。
+    """
+
+    def __init__(
+        self, owners: list[tuple[str, str]], owner_ids: np.ndarray, values: list[str], top_n: int = 8
+    ):
+        self.top_n = top_n
+        self.owners = owners
+        self.owner_ids = owner_ids
+        self.values = values
+        self._normalized = [_normalize(v) for v in values]
+        self._exact: dict[str, list[int]] = {}
+        for i, norm in enumerate(self._normalized):
+            self._exact.setdefault(norm, []).append(i)
+
+        # trigram -> 取值 id 的 CSR 倒排表
+        postings: dict[str, list[int]] = {}
+        sizes = np.zeros(len(values), dtype=np.int32)
+        for i, norm in enumerate(self._normalized):
+            grams = _trigrams(norm)
+            sizes[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self._gram_sizes = sizes
+        self._gram_rows = {gram: row for row, gram in enumerate(postings)}
+        lengths = np.fromiter((len(ids) for ids in postings.values()), dtype=np.int64, count=len(postings))
+        self._indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self._ids = np.fromiter(
+            (i for ids in postings.values() for i in ids), dtype=np.int32, count=int(self._indptr[-1])
+        )
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @classmethod
+    def build(cls, db_path: str, top_n: int = 8) -> "ValueIndex":
+        owners: list[tuple[str, str]] = []
+        owner_ids: list[int] = []
+        values: list[str] = []
+        conn = sqlite3.connect(db_path)
+        try:
+            tables = [
+                r[0]
+                for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
+                if not r[0].startswith("sqlite_")
+            ]
+            for table in tables:
+                quoted_table = '"' + table.replace('"', '""') + '"'
+                for col in conn.execute(f"PRAGMA table_info({quoted_table})").fetchall():
+                    name = col[1]
+                    quoted = '"' + name.replace('"', '""') + '"'
+                    rows = conn.execute(
+                        f"SELECT DISTINCT {quoted} FROM {quoted_table} "
+                        f"WHERE typeof({quoted}) = 'text' AND length({quoted}) <= ? LIMIT ?",
+                        (_MAX_VALUE_LENGTH, _MAX_VALUES_PER_COLUMN),
+                    ).fetchall()
+                    # 只索引含字母的取值，纯数字编号交给 Schema 与示例处理。
+                    # 取值原样保存（如 'A '），匹配时才归一化，生成的字面量才能与库中相等
+                    col_values = [r[0] for r in rows if any(ch.isalpha() for ch in r[0])]
+                    if not col_values:
+                        continue
+                    owners.append((table, name))
+                    owner_ids.extend([len(owners) - 1] * len(col_values))
+                    values.extend(col_values)
+        finally:
+            conn.close()
+        return cls(owners, np.asarray(owner_ids, dtype=np.int32), values, top_n)
+
+    @classmethod
+    def load(cls, db_path: str, cache_dir: str | None = None, top_n: int = 8) -> "ValueIndex":
+        """从 cache_dir 读取与当前数据库指纹一致的索引，不存在时构建并保存。"""
+        fingerprint = db_fingerprint(db_path)
+        if not cache_dir or fingerprint is None:
+            return cls.build(db_path, top_n)
+        name = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"values-v{_CACHE_VERSION}-{name}.npz")
+        if os.path.exists(path):
+            with np.load(path) as data:
+                owners = [tuple(o.split("\x1f", 1)) for o in data["owners"].tolist()]
+                values = data["values"].tolist()
+                return cls(owners, data["owner_ids"], values, top_n)
+
+        index = cls.build(db_path, top_n)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            owners=np.array([f"{t}\x1f{c}" for t, c in index.owners], dtype=np.str_),
+            owner_ids=index.owner_ids,
+            values=np.array(index.values, dtype=np.str_),
+        )
+        os.replace(tmp_path, path)
+        return index
+
+    def _spans(self, question: str) -> list[str]:
+        words = _WORD_RE.findall(question)
+        spans: list[str] = []
+        for i in range(len(words)):
+            for j in range(i + 1, min(i + _MAX_SPAN_WORDS, len(words)) + 1):
+                span_words = words[i:j]
+                span = _normalize(" ".join(span_words))
+                # 单个字符（如 "c"）会精确命中成绩、时间段等大量取值，不参与匹配
+                if len(span) > 1 and not all(w in _STOPWORDS for w in span.split()):
+                    spans.append(span)
+        return spans
+
+    def lookup(self, question: str, top_n: int | None = None, threshold: float = 0.6) -> list[ValueHit]:
+        top_n = self.top_n if top_n is None else top_n
+        best: dict[int, tuple[float, str]] = {}
+
+        def record(value_id: int, score: float, span: str) -> None:
+            if score > best.get(value_id, (0.0, ""))[0]:
+                best[value_id] = (score, span)
+
+        for span in self._spans(question):
+            for value_id in self._exact.get(span, ()):
+                record(value_id, 1.0, span)
+            # 短片段只做精确匹配，避免 "math" 之类模糊匹配到大量取值
+            if len(span) < 4:
+                continue
+            grams = [self._gram_rows[g] for g in _trigrams(span) if g in self._gram_rows]
+            if not grams:
+                continue
+            candidates = np.concatenate([self._ids[self._indptr[r]:self._indptr[r + 1]] for r in grams])
+            ids, shared = np.unique(candidates, return_counts=True)
+            total = len(_trigrams(span))
+            sims = shared / (total + self._gram_sizes[ids] - shared)
+            for value_id, sim in zip(ids[sims >= threshold].tolist(), sims[sims >= threshold].tolist()):
+                record(value_id, sim, span)
+
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], -len(item[1][1])))[:top_n]
+        hits = []
+        for value_id, (score, span) in ranked:
+            table, column = self.owners[int(self.owner_ids[value_id])]
+            hits.append(ValueHit(table, column, self.values[value_id], span, round(score, 3)))
+        return hits
+
+
+def main() -> None:
+    config = load_config()
+    parser = argparse.ArgumentParser(description="构建数据库取值索引并测试查找")
+    parser.add_argument("--db_path", default=config.db_path)
+    parser.add_argument("--cache_dir", default=config.value_index_dir)
+    parser.add_argument("--question", default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = ValueIndex.load(args.db_path, args.cache_dir, config.value_index_top)
+    print(f"取值索引: {len(index)} 个取值, {len(index.owners)} 列, 耗时 {time.perf_counter() - start:.2f}s")
+    if args.question:
+        start = time.perf_counter()
+        hits = index.lookup(args.question)
+        print(f"查找耗时 {(time.perf_counter() - start) * 1000:.2f}ms")
+        for hit in hits:
+            print(f"  {hit.to_text()}  <- '{hit.span}' ({hit.score})")
+
+
+if __name__ == "__main__":
+    main()
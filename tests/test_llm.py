@@ -0,0 +1,89 @@
+import pytest
+
+from src.llm import LLMClient, SQLStream, _statement_end
+from src.llm_cache import LLMResponseCache
+
+PROMPT = "数据库Schema:\nstudent(ID, name)\n\n问题: List all student names.\nSQL:"
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    return LLMClient("test-model", api_key=None, base_url=None)
+
+
+def _fake_model(llm, reply):
+    prompts = []
+
+    def fake_invoke(prompt):
+        prompts.append(prompt)
+        return reply
+
+    llm._invoke = fake_invoke
+    return prompts
+
+
+def _stream(llm, chunks):
+    consumed = []
+
+    def fake_stream(prompt):
+        for chunk in chunks:
+            consumed.append(chunk)
+            yield chunk
+
+    llm._stream = fake_stream
+    stream = SQLStream(llm, PROMPT)
+    return "".join(stream), stream.sql, consumed
+
+
+def test_fenced_block_after_prose():
+    text = "Here's the SQL:\n```sql\nSELECT name FROM student\n```\nThis lists all names."
+    assert text[: _statement_end(text)] == "Here's the SQL:\n```sql\nSELECT name FROM student\n```"
+
+
+def test_stream_stops_at_closing_fence_after_prose(llm):
+    chunks = ["Here's the SQL:\n", "```sql\nSELECT name ", "FROM student\n```", "\nThis lists ", "all names."]
+    shown, sql, consumed = _stream(llm, chunks)
+    assert sql == "SELECT name FROM student"
+    assert shown.endswith("```")
+    assert len(consumed) == 3
+
+
+def test_prose_containing_select_is_skipped():
+    text = "I will select the students. SELECT name FROM student; That's all."
+    assert text[: _statement_end(text)] == "I will select the students. SELECT name FROM student;"
+
+
+def test_stream_skips_prose_containing_select(llm):
+    chunks = ["I will select the student's ", "names. SELECT name ", "FROM student;", " That's all."]
+    shown, sql, consumed = _stream(llm, chunks)
+    assert sql == "SELECT name FROM student"
+    assert len(consumed) == 3
+
+
+def test_cte_after_prose():
+    text = "Sure, here's a CTE: WITH c AS (SELECT 1 AS a) SELECT a FROM c; that's it"
+    assert text[: _statement_end(text)].endswith("SELECT a FROM c;")
+
+
+CTE = "WITH c AS (SELECT name FROM student) SELECT name FROM c"
+
+
+def test_cte_draft_is_reviewed_once_and_cached(llm, tmp_path):
+    llm.cache = LLMResponseCache(str(tmp_path / "llm.sqlite"))
+    prompts = _fake_model(llm, CTE)
+
+    assert llm.generate_sql(PROMPT) == CTE
+    # 一次起草 + 一次复查，没有强制重新生成
+    assert len(prompts) == 2
+    assert "候选SQL: " + CTE in prompts[1]
+
+    assert llm.generate_sql(PROMPT) == CTE
+    assert len(prompts) == 2
+
+
+def test_streamed_cte_is_reviewed(llm):
+    prompts = _fake_model(llm, CTE)
+    assert llm.review_sql(PROMPT, CTE) == CTE
+    assert len(prompts) == 1
+    assert "候选SQL: " + CTE in prompts[0]
@@ -0,0 +1,21 @@
+from pathlib import Path
+
+import pytest
+
+from src.sql_executor import QueryCostError, ResultCache, SQLExecutor
+
+DB_PATH = str(Path(__file__).resolve().parents[1] / "data" / "database" / "college_2" / "college_2.sqlite")
+
+
+def test_cached_result_does_not_bypass_stricter_max_cost():
+    executor = SQLExecutor(cache=ResultCache(), max_cost=1e8)
+    sql = "SELECT * FROM takes"
+    try:
+        result = executor.execute(DB_PATH, sql)
+        assert result.row_count > 0
+        assert executor.execute(DB_PATH, sql) is result
+
+        with pytest.raises(QueryCostError):
+            executor.execute(DB_PATH, sql, max_cost=1)
+    finally:
+        executor.close()